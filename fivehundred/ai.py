@@ -1,17 +1,158 @@
+import itertools
 import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+# trick weights of trump cards by value, see Card.value
+TRUMP_WEIGHTS = {400: 1.0, 300: 1.0, 200: 0.9, 115: 0.8, 114: 0.6, 113: 0.5}
+# misere danger of cards by strength, see Card.strengths
+MISERE_DANGER = {15: 1.5, 14: 1.0, 13: 0.6, 12: 0.3}
+
+_discard_cache = {}
+_discard_cache_size = 200000
+_executor = None
+
+
+def evaluate_hand(cards, bid):
+    """Fast evaluation of a 10 card hand for a contract.
+
+    Args:
+        cards (list): list of Card objects kept
+        bid (Bid): contract being played
+
+    Returns:
+        score, estimated tricks for trump and no trump contracts, negative
+        danger for misere
+    """
+    trump = bid.suit
+    values = cards[0].values[trump]
+    suits = cards[0].suits[trump]
+    strengths = cards[0].strengths
+    by_suit = [[], [], [], []]
+    trumps = 0
+    score = 0.0
+
+    for card in cards:
+        value = values[card.id]
+        if card.joker and bid.misere:
+            score -= 3.0
+        elif value:  # joker, bowers and trumps
+            trumps += 1
+            score += TRUMP_WEIGHTS.get(value, 0.5)
+        else:
+            by_suit[suits[card.id]].append(strengths[card.id])
+
+    for suit, ranks in enumerate(by_suit):
+        if suit == trump:
+            continue
+        if bid.misere:
+            score -= sum(MISERE_DANGER.get(rank, 0) for rank in ranks)
+            # low cards protect the high ones, voids let us shed them
+            score += 0.8 if not ranks else 0.2 * sum(rank < 6 for rank in ranks)
+            continue
+
+        ranks.sort(reverse=True)
+        if not ranks:  # void, can trump in
+            score += 0.5 * (trumps >= 2)
+        elif len(ranks) == 1 and trumps >= 2:
+            score += 0.25
+        for rank in ranks:
+            # honours need enough guards below them, e.g. K-x, Q-x-x
+            if rank >= 13 and len(ranks) > 15 - rank:
+                score += 0.9 if rank == 15 else 0.5
+            score += 0.02 * rank
+        if trump is None and ranks and ranks[0] == 15:  # long suits run in no trumps
+            score += 0.4 * max(len(ranks) - 4, 0)
+
+    return score
+
+
+def score_hand(cards):
+    """Scores a hand for bidding.
+
+    Returns:
+        (suit_scores, misere) - maximum tricks for each suit and no trumps,
+        misere danger count
+    """
+    # initialise scores
+    suit_scores = [0, 0, 0, 0, 0]
+    misere = 0
+
+    # score each card
+    for card in cards:
+        if card.joker:
+            suit_scores = [ss + 15 for ss in suit_scores]
+            misere += 2
+        else:
+            rank = card.rank if card.rank < 13 else 8  # 11s-13s as tens
+            misere += rank > 7
+            suit_scores[card.suit] += rank
+            if rank > 10:
+                suit_scores[4] += rank
+            if rank == 9:
+                suit_scores[card.suit] += 5
+                suit_scores[(card.suit + 2) % 4] += 4
+
+    # turn scores to maximum tricks
+    return [(ss // 15) + 5 for ss in suit_scores], misere
+
+
+def strength(card, lead_suit, values):
+    """Strength of a card in a trick, see Trick.get_winner.
+
+    Args:
+        card (Card): card played
+        lead_suit (int): suit led
+        values (list): card values by id for the trump suit
+    """
+    if not card.joker and card.suit == lead_suit:
+        return max(card.strengths[card.id] + 1, values[card.id])
+    return values[card.id]
+
+
+def _score_discards(cards, bid, discards):
+    """Scores each candidate discard, returns list of scores."""
+    scores = []
+    for discard in discards:
+        kept = [card for i, card in enumerate(cards) if i not in discard]
+        scores.append(evaluate_hand(kept, bid))
+    return scores
 
 
 class Policy(object):
     """Policy class.
 
+    Args:
+        discard_budget (float): seconds allowed per exhaustive discard
+        discard_workers (int): worker processes for exhaustive discard
+        bid_strategy (BidStrategy): learned bidding strategy, see cfr.py
+        tablebase (Tablebase): endgame tablebase, see endgame.py
+
     Functions:
         bid: policy for bidding round
         discard: policy for discard round
         card: policy for card playing round
     """
 
-    def __init__(self):
-        pass
+    discard_budget = 0.05
+    discard_workers = 1
+    bid_strategy = None
+    tablebase = None
+    endgame_samples = 20
+    endgame_rollouts = 10
+
+    def __init__(
+        self, discard_budget=None, discard_workers=None, bid_strategy=None, tablebase=None
+    ):
+        if discard_budget is not None:
+            self.discard_budget = discard_budget
+        if discard_workers is not None:
+            self.discard_workers = discard_workers
+        if bid_strategy is not None:
+            self.bid_strategy = bid_strategy
+        if tablebase is not None:
+            self.tablebase = tablebase
 
     def bid(self, env, type_):
         """Bidding round policy"""
@@ -23,26 +164,7 @@ class Policy(object):
                 bid_text = random.choice(possible)
 
         elif type_ == "score":
-            # initialise scores
-            suit_scores = [0, 0, 0, 0, 0]
-            misere = 0
-
-            # score each card
-            for card in player.cards:
-                if card.joker:
-                    suit_scores = [ss + 15 for ss in suit_scores]
-                    misere += 2
-                else:
-                    misere += card.rank > 7
-                    suit_scores[card.suit] += card.rank
-                    if card.rank > 10:
-                        suit_scores[4] += card.rank
-                    if card.rank == 9:
-                        suit_scores[card.suit] += 5
-                        suit_scores[(card.suit + 2) % 4] += 4
-
-            # turn scores to maximum tricks
-            suit_scores = [(ss // 15) + 5 for ss in suit_scores]
+            suit_scores, misere = score_hand(player.cards)
 
             # get lowest possible bid that meets score thresholds
             for bid in possible:
@@ -54,9 +176,15 @@ class Policy(object):
                         bid_text = bid
                         break
                 else:
-                    if Bid(bid).tricks <= suit_scores[Bid(bid).suit_rank]:
+                    candidate = Bid(bid)
+                    if candidate.tricks <= suit_scores[candidate.suit_rank]:
                         bid_text = bid
                         break
+
+        elif type_ == "cfr":
+            bid_text = self.bid_strategy.bid(env)
+            if bid_text is None:  # hand never seen in training
+                bid_text = Policy.bid(self, env, "score")
         else:
             raise ValueError
 
@@ -72,31 +200,103 @@ class Policy(object):
             for card in cards
             if card.suit == bid.suit or card.joker or card.bower() is not None
         ]
-        discard_list = list(set(cards) - set(keep_list))
+        discard_list = [card for card in cards if card not in keep_list]
 
         if type_ == "random":
             discard_cards = random.sample(discard_list, 3)
 
         elif type_ == "lowest":
             reverse = bid.misere is not None
-            discard_cards = sorted(discard_list, key=lambda x: x.rank, reverse=reverse)[
+            discard_cards = sorted(
+                discard_list, key=lambda x: x.strengths[x.id], reverse=reverse
+            )[
                 :3
             ]
             discard_cards += sorted(keep_list, reverse=reverse)[
                 : 3 - len(discard_cards)
             ]
 
-        # TODO: by suit
+        elif type_ == "exhaustive":
+            discard_cards = self.exhaustive_discard(cards, bid)
+
         else:
             raise ValueError
 
         return discard_cards
 
+    def exhaustive_discard(self, cards, bid, budget=None):
+        """Evaluates every 3 card discard within the latency budget.
+
+        Notes:
+            Scores are cached across decisions by contract and kept cards.
+            Candidates are tried lowest cards first so the best found so
+            far is a reasonable discard when the budget runs out.
+
+        Args:
+            cards (list): list of Card objects in hand including kitty
+            bid (Bid): winning bid
+            budget (float): seconds allowed, discard_budget if NoneType
+
+        Returns:
+            list of 3 Card objects to discard
+        """
+        global _executor
+        if budget is None:
+            budget = self.discard_budget
+        deadline = time.perf_counter() + budget
+        sort_keys = cards[0].sort_keys[bid.suit]
+        order = sorted(
+            range(len(cards)),
+            key=lambda i: sort_keys[cards[i].id],
+            reverse=bid.misere is not None,
+        )
+        candidates = list(itertools.combinations(order, 3))
+
+        def key(discard):
+            return bid.id, tuple(
+                sorted(card.id for i, card in enumerate(cards) if i not in discard)
+            )
+
+        if len(_discard_cache) > _discard_cache_size:
+            _discard_cache.clear()
+        scores = {}
+        todo = []
+        for discard in candidates:
+            cached = _discard_cache.get(key(discard))
+            if cached is None:
+                todo.append(discard)
+            else:
+                scores[discard] = cached
+
+        if self.discard_workers > 1 and todo:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(self.discard_workers)
+            chunks = [todo[i :: self.discard_workers] for i in range(self.discard_workers)]
+            futures = {
+                _executor.submit(_score_discards, cards, bid, chunk): chunk
+                for chunk in chunks
+            }
+            done, _ = wait(futures, timeout=max(deadline - time.perf_counter(), 0))
+            for future in done:
+                for discard, score in zip(futures[future], future.result()):
+                    scores[discard] = _discard_cache[key(discard)] = score
+        else:
+            for discard in todo:
+                if scores and time.perf_counter() > deadline:
+                    break
+                score = _score_discards(cards, bid, [discard])[0]
+                scores[discard] = _discard_cache[key(discard)] = score
+
+        if not scores:  # budget ran out before any worker finished
+            return [cards[i] for i in candidates[0]]
+        best = max(candidates, key=lambda d: scores.get(d, float("-inf")))
+        return [cards[i] for i in best]
+
     def card(self, env, type_):
         """Card playing policy"""
-        player, trick, tricks = env
+        player, trick, tricks, knowledge = env
         psv = {
-            i: (player.cards[i].value(), player.cards[i].rank)
+            i: (player.cards[i].value(), player.cards[i].strengths[player.cards[i].id])
             for i in player.possible_index
         }
         lowest_index = min(psv, key=lambda k: psv[k])
@@ -139,7 +339,7 @@ class Policy(object):
                     else:
                         card_index = highest_index
 
-                elif len(trick.cards) == 3:
+                elif len(trick.cards) >= 3:
                     # partner has already won
                     if trick.get_winner() == 1:
                         card_index = lowest_index
@@ -149,7 +349,285 @@ class Policy(object):
 
                 else:
                     raise RuntimeError
+
+        elif type_ == "counting":
+            card_index = self.counting_card(player, trick, knowledge)
+
+        elif type_ == "endgame":
+            card_index = self.endgame_card(player, trick, knowledge)
+
         else:
             raise ValueError
 
         return card_index
+
+    def counting_card(self, player, trick, knowledge):
+        """Card play using what the seat knows of the unplayed cards.
+
+        Args:
+            player (Hand): hand of the player with possible set
+            trick (Trick): current trick
+            knowledge (Knowledge): card counting of the player
+
+        Returns:
+            hand index of card to play
+        """
+        seat = knowledge.seat
+        rules = trick.rules
+        deck = player.cards[0].cards
+        values = deck[0].values[knowledge.trump]
+        strengths = deck[0].strengths
+        possible = sorted(
+            player.possible_index,
+            key=lambda i: (values[player.cards[i].id], strengths[player.cards[i].id]),
+        )
+        opponents = [
+            i for i in range(rules.players) if rules.team(i) != rules.team(seat)
+        ]
+
+        # misere player sheds the highest card that does not win
+        if trick.misere is not None:
+            if trick.misere == seat and trick.cards:
+                best = max(strength(c, trick.lead_suit, values) for c in trick.cards)
+                losing = [
+                    i
+                    for i in possible
+                    if strength(player.cards[i], trick.lead_suit, values) < best
+                ]
+                if losing:
+                    return losing[-1]
+            return possible[0]
+
+        # lead a top trump while opponents may hold trumps, or a top card
+        # of a suit the opponents can still follow, otherwise lead low
+        if not trick.cards:
+            unseen = [deck[i] for i in knowledge.unseen_ids()]
+            for i in reversed(possible):
+                card = player.cards[i]
+                suit = knowledge.suits[card.id]
+                rivals = [c for c in unseen if knowledge.suits[c.id] == suit]
+                if values[card.id]:
+                    if knowledge.trumps_unseen and all(
+                        values[c.id] < values[card.id] for c in rivals
+                    ):
+                        return i
+                elif all(strengths[c.id] < strengths[card.id] for c in rivals) and not any(
+                    knowledge.is_void(opponent, suit) for opponent in opponents
+                ):
+                    return i
+            return possible[0]
+
+        # opponents still to play after this seat
+        following = []
+        turn = seat
+        for _ in range(rules.players - 1 - len(trick.cards)):
+            turn = (turn + 1) % rules.players
+            following.append(turn)
+        opponents = [turn for turn in following if turn in opponents]
+
+        def safe(card_strength):
+            """No following opponent can hold a card beating card_strength"""
+            for card_id in knowledge.unseen_ids():
+                card = deck[card_id]
+                if strength(card, trick.lead_suit, values) > card_strength and any(
+                    knowledge.can_hold(opponent, card) for opponent in opponents
+                ):
+                    return False
+            return True
+
+        best = max(strength(c, trick.lead_suit, values) for c in trick.cards)
+        if rules.team(trick.get_winner()) == rules.team(seat) and safe(best):
+            return possible[0]
+
+        winning = [
+            i
+            for i in possible
+            if strength(player.cards[i], trick.lead_suit, values) > best
+        ]
+        for i in winning:  # cheapest card that holds the trick
+            if safe(strength(player.cards[i], trick.lead_suit, values)):
+                return i
+        if winning:
+            return winning[-1]
+        return possible[0]
+
+    def endgame_card(self, player, trick, knowledge):
+        """Card play solving sampled deals.
+
+        Notes:
+            The hidden hands are sampled from what the seat knows and each
+            possible card is scored on every sample: exactly with the
+            endgame tablebase once the hands are within it, by random
+            playouts (see kernels.py) before that or for rule sets the
+            tablebase does not cover.
+
+        Args:
+            player (Hand): hand of the player with possible set
+            trick (Trick): current trick
+            knowledge (Knowledge): card counting of the player
+
+        Returns:
+            hand index of card to play
+        """
+        from kernels import random_playouts
+
+        rules = trick.rules
+        players = rules.players
+        tablebase = self.tablebase
+        exact = (
+            tablebase is not None
+            and players == 4
+            and rules.teams == 2
+            and len(player.cards) - 1 <= tablebase.max_cards
+        )
+
+        seat = knowledge.seat
+        deck = player.cards[0].cards
+        values = deck[0].values[knowledge.trump]
+        strengths = deck[0].strengths
+        possible = sorted(
+            player.possible_index,
+            key=lambda i: (values[player.cards[i].id], strengths[player.cards[i].id]),
+        )
+        if len(possible) == 1:
+            return possible[0]
+
+        # seats that played to the trick hold one card less
+        partner = None
+        if trick.misere is not None and rules.partner:
+            partner = (trick.misere + rules.partner) % players
+        played = []
+        turn = trick.lead
+        for _ in trick.cards:
+            played.append(turn)
+            turn = (turn + 1) % players
+            if turn == partner:
+                turn = (turn + 1) % players
+        sizes = {
+            s: len(player.cards) - (s in played)
+            for s in range(players)
+            if s not in (seat, partner)
+        }
+        team = [s for s in range(players) if rules.team(s) == rules.team(seat)]
+
+        totals = dict.fromkeys(possible, 0)
+        for _ in range(self.endgame_samples):
+            hidden = knowledge.sample_hands(deck, sizes)
+            if any(len(hidden[s]) != sizes[s] for s in sizes):
+                continue
+            hands = [hidden.get(s, []) for s in range(players)]
+            for i in possible:
+                hands[seat] = player.cards[:i] + player.cards[i + 1 :]
+                cards = trick.cards + [player.cards[i]]
+                if exact:
+                    totals[i] += tablebase.solve(
+                        hands, trick.lead, knowledge.trump, cards, trick.misere, seat
+                    )
+                    continue
+                won = random_playouts(
+                    hands,
+                    trick.lead,
+                    knowledge.trump,
+                    trick.misere,
+                    rules,
+                    self.endgame_rollouts,
+                    cards=cards,
+                )
+                if trick.misere is not None:
+                    totals[i] += won[trick.misere]
+                else:
+                    totals[i] += sum(won[s] for s in team)
+
+        # tricks of the seat's team, or of the misere player
+        if trick.misere == seat:
+            return min(possible, key=totals.get)
+        return max(possible, key=totals.get)
+
+
+class Ponderer(object):
+    """Runs speculative decisions in a background thread.
+
+    Notes:
+        Meant for while the main thread is blocked on input() for a human,
+        the only time a thread has the interpreter to itself. A search is
+        a generator yielding (key, decision) pairs, the game pops a
+        decision by key when it reaches that state instead of deciding
+        from scratch. Stopping waits for the decision in progress.
+
+        Pondering shares the module level random generator with the game.
+        Stopping restores the state it had when pondering started, and a
+        decision is only reused from the random state it was made from,
+        leaving the state as after the decision. A seeded game plays the
+        same with or without pondering.
+
+    Args:
+        budget (float): seconds allowed per pondered exhaustive discard
+        check (bool): compare each reused card decision with a fresh one
+
+    Attributes:
+        results (dict): pondered decisions by key
+        hits (int): number of pondered decisions reused
+    """
+
+    def __init__(self, budget=1.0, check=False):
+        self.budget = budget
+        self.check = check
+        self.results = {}
+        self.hits = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._state = None
+
+    def __reduce__(self):
+        return Ponderer, (self.budget, self.check)
+
+    def start(self, search, *args):
+        """Starts pondering, discarding any earlier results.
+
+        Args:
+            search (callable): generator function yielding (key, decision)
+            args: arguments of search
+        """
+        self.stop()
+        self.results = {}
+        self._state = random.getstate()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(search(*args),), daemon=True)
+        self._thread.start()
+
+    def _run(self, decisions):
+        while True:
+            before = random.getstate()
+            try:
+                key, decision = next(decisions)
+            except StopIteration:
+                break
+            self.results[key] = (decision, before, random.getstate())
+            if self._stop.is_set():
+                break
+
+    def rewind(self):
+        """Restores the random state pondering started from, for a search
+        trying alternatives from the current game state."""
+        random.setstate(self._state)
+
+    def stop(self):
+        """Stops pondering, keeping the results so far."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            random.setstate(self._state)
+
+    def pop(self, key):
+        """Returns and removes a pondered decision, NoneType if none or
+        if it was made from another random state."""
+        result = self.results.pop(key, None)
+        if result is None:
+            return None
+        decision, before, after = result
+        if random.getstate() != before:
+            return None
+        random.setstate(after)
+        self.hits += 1
+        return decision
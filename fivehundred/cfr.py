@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Counterfactual regret minimisation for the bidding round.
+
+Bidding is abstracted to information sets of (hand bucket, cheapest
+possible bid in the best denomination, whether the highest bidder is the
+partner). A hand bucket is the best denomination, its estimated tricks and
+the misere danger, see ai.score_hand. The actions are pass, 6 to 10 tricks
+in the best denomination, closed misere and open misere.
+
+Worker processes run outcome sampling MCCFR: each iteration deals a round,
+bids with the current regret matching strategy, plays the round out with
+the engine policies and updates the regrets of one seat. The regret and
+strategy tables are shared memory arrays updated without locking, an
+occasional lost update only adds noise. The main process checkpoints the
+tables, and the average strategy is played by Policy.bid type "cfr":
+
+    python fivehundred/cfr.py --iterations 1000000 --out bidding.cfr
+    python fivehundred/game.py --bidai cfr --bidstrategy bidding.cfr
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import struct
+import time
+from array import array
+from multiprocessing.sharedctypes import RawArray
+
+import game
+from ai import Policy, score_hand
+from game import RULES, Game
+
+NUM_BUCKETS = 5 * 5 * 5  # best denomination, tricks, misere danger
+NUM_LEVELS = 6  # cheapest possible tricks in the best denomination, 6-10 or none
+NUM_INFO_SETS = NUM_BUCKETS * NUM_LEVELS * 2
+NUM_ACTIONS = 8  # pass, 6-10 tricks, CM, OM
+
+# checkpoint header: magic, rules, info sets, actions, iterations
+HEADER = struct.Struct("<8s16sIIQ")
+MAGIC = b"500CFR01"
+
+
+def info_set(cards, bids, possible, rules):
+    """Returns the information set index and actions of a seat.
+
+    Args:
+        cards (list): list of Card objects held by the seat
+        bids (list): list of Bid objects so far, the seat bids next
+        possible (list): possible bid strings
+        rules (Rules): rule set of the game
+
+    Returns:
+        (info set, bid strings of the actions, indices of legal actions)
+    """
+    suit_scores, misere = score_hand(cards)
+    best = suit_scores.index(max(suit_scores))
+    tricks = min(max(suit_scores[best], 6), 10) - 6
+    bucket = (best * 5 + tricks) * 5 + min(misere, 4)
+
+    texts = action_bids(best)
+    legal = [0] + [a for a in range(1, NUM_ACTIONS) if texts[a] in possible]
+    level = next((a - 1 for a in legal if 0 < a < 6), NUM_LEVELS - 1)
+
+    highest = 0
+    partner = 0
+    for i, bid in enumerate(bids):
+        if (rules.order[bid.id] or 0) > highest:
+            highest = rules.order[bid.id]
+            partner = (i - len(bids)) % rules.players == rules.partner
+    return (bucket * NUM_LEVELS + level) * 2 + partner, texts, legal
+
+
+def action_bids(best):
+    """Returns the bid strings of the actions for a best denomination."""
+    denomination = "SCDHN"[best]
+    return [""] + ["%s%s" % (tricks, denomination) for tricks in range(6, 11)] + ["CM", "OM"]
+
+
+def regret_matching(regrets, base, legal):
+    """Returns the current strategy over the legal actions of an info set."""
+    positive = [max(regrets[base + a], 0.0) for a in legal]
+    total = sum(positive)
+    if total > 0:
+        return [p / total for p in positive]
+    return [1.0 / len(legal)] * len(legal)
+
+
+def save_tables(path, rules_name, regrets, strategy, iterations):
+    """Writes a checkpoint, replacing any previous one atomically."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, rules_name.encode(), NUM_INFO_SETS, NUM_ACTIONS, iterations))
+        f.write(array("d", regrets).tobytes())
+        f.write(array("d", strategy).tobytes())
+    os.replace(tmp, path)
+
+
+def load_tables(path):
+    """Reads a checkpoint.
+
+    Returns:
+        (rules_name, iterations, regrets, strategy)
+
+    Raises:
+        ValueError: if the file is not a checkpoint for these tables
+    """
+    with open(path, "rb") as f:
+        magic, rules_name, info_sets, actions, iterations = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or (info_sets, actions) != (NUM_INFO_SETS, NUM_ACTIONS):
+            raise ValueError("%s is not a bidding strategy checkpoint" % path)
+        size = NUM_INFO_SETS * NUM_ACTIONS
+        regrets = array("d")
+        regrets.fromfile(f, size)
+        strategy = array("d")
+        strategy.fromfile(f, size)
+    return rules_name.rstrip(b"\0").decode(), iterations, regrets, strategy
+
+
+class BidStrategy(object):
+    """Average strategy learned by the trainer, see Policy.bid.
+
+    Args:
+        rules (Rules): rule set the strategy was trained for
+        strategy (array): strategy sums by info set and action
+        iterations (int): number of training iterations
+    """
+
+    def __init__(self, rules, strategy, iterations=0):
+        self.rules = rules
+        self.strategy = strategy
+        self.iterations = iterations
+
+    @classmethod
+    def load(cls, path, rules_name=None):
+        """Loads the strategy from a checkpoint.
+
+        Args:
+            path (str): checkpoint file
+            rules_name (str): rule set the strategy is played with, see
+                RULES, any if NoneType
+
+        Raises:
+            ValueError: if the checkpoint was trained for other rules
+        """
+        checkpoint_rules, iterations, _, strategy = load_tables(path)
+        if rules_name is not None and checkpoint_rules != rules_name:
+            raise ValueError("%s was trained for %s rules" % (path, checkpoint_rules))
+        return cls(RULES[checkpoint_rules], strategy, iterations)
+
+    def bid(self, env):
+        """Returns the most likely bid, NoneType if the info set was never
+        trained.
+
+        Notes:
+            Playing the most likely action (purification) rather than
+            sampling the average strategy drops the exploratory bids of
+            early iterations still in the averages.
+        """
+        player, bids, possible, Bid = env
+        info, texts, legal = info_set(player.cards, bids, possible, self.rules)
+        base = info * NUM_ACTIONS
+        weights = [self.strategy[base + a] for a in legal]
+        if max(weights) <= 0:
+            return None
+        return texts[legal[weights.index(max(weights))]]
+
+
+class TrainingPolicy(Policy):
+    """Policy bidding with the current strategy of the shared tables.
+
+    Args:
+        regrets (RawArray): shared cumulative regrets
+        strategy (RawArray): shared strategy sums
+        rules (Rules): rule set of the game
+        epsilon (float): exploration of the traversing seat
+
+    Attributes:
+        players (list): Hand objects of the game being played
+        traverser (int): seat whose regrets are updated this round
+        path (list): (info set, legal, strategy, action, sample probability)
+            of the traverser's decisions this round
+    """
+
+    def __init__(self, regrets, strategy, rules, epsilon=0.3):
+        super(TrainingPolicy, self).__init__()
+        self.regrets = regrets
+        self.strategy = strategy
+        self.rules = rules
+        self.epsilon = epsilon
+        self.players = []
+        self.traverser = 0
+        self.path = []
+
+    def bid(self, env, type_):
+        if type_ != "cfr":
+            return super(TrainingPolicy, self).bid(env, type_)
+        player, bids, possible, Bid = env
+        info, texts, legal = info_set(player.cards, bids, possible, self.rules)
+        sigma = regret_matching(self.regrets, info * NUM_ACTIONS, legal)
+
+        if self.players.index(player) != self.traverser:
+            return texts[random.choices(legal, sigma)[0]]
+
+        explore = self.epsilon / len(legal)
+        sample = [explore + (1 - self.epsilon) * p for p in sigma]
+        i = random.choices(range(len(legal)), sample)[0]
+        self.path.append((info, legal, sigma, i, sample[i]))
+        return texts[legal[i]]
+
+    def update(self, round_):
+        """Updates the shared tables from the traverser's decisions."""
+        scores = round_.scores
+        team = self.rules.team(self.traverser)
+        others = (sum(scores) - scores[team]) / (len(scores) - 1)
+        utility = (scores[team] - others) / 100.0
+
+        # regrets, sampled counterfactual value of the action taken
+        q = 1.0
+        for decision in self.path:
+            q *= decision[4]
+        tail = 1.0
+        for info, legal, sigma, i, _ in reversed(self.path):
+            value = utility * tail / q
+            base = info * NUM_ACTIONS
+            for j, a in enumerate(legal):
+                self.regrets[base + a] += value * ((j == i) - sigma[i])
+            tail *= sigma[i]
+
+        # average strategy, weighted by reach over sample probability
+        weight = 1.0
+        for info, legal, sigma, i, sample in self.path:
+            base = info * NUM_ACTIONS
+            for j, a in enumerate(legal):
+                self.strategy[base + a] += weight * sigma[j]
+            weight *= sigma[i] / sample
+        self.path = []
+
+
+def worker(regrets, strategy, counts, index, iterations, rules_name, policies, epsilon, seed):
+    """Worker process running training iterations."""
+    random.seed(seed)
+    discard_policy, card_policy = policies
+    rules = RULES[rules_name]
+    policy = TrainingPolicy(regrets, strategy, rules, epsilon)
+    g = None
+    for iteration in range(iterations):
+        if g is None or g.status != "In progress":
+            g = Game(policy=policy, rules=rules)
+            policy.players = g.players
+        policy.traverser = (index + iteration) % rules.players
+
+        game.trump_suit = None
+        g.start_round()
+        g.bid_round(policy="cfr")
+        if g.round.status == "Bidding complete":
+            game.trump_suit = g.round.trump_suit
+            g.discard_round(policy=discard_policy)
+            g.card_round(policy=card_policy)
+        g.end_round()
+        policy.update(g.round)
+        counts[index] += 1
+    game.trump_suit = None
+
+
+def train(iterations, workers, out, rules_name, policies, epsilon, resume=False, interval=30.0):
+    """Runs the trainer, checkpointing the tables while it runs.
+
+    Args:
+        iterations (int): total number of iterations (rounds)
+        workers (int): number of worker processes
+        out (str): checkpoint file
+        rules_name (str): rule set, see RULES
+        policies (tuple): (discard, card) policy types for playing out
+        epsilon (float): exploration of the traversing seat
+        resume (bool): continue from the checkpoint if it exists
+        interval (float): seconds between checkpoints
+    """
+    size = NUM_INFO_SETS * NUM_ACTIONS
+    regrets = RawArray("d", size)
+    strategy = RawArray("d", size)
+    done = 0
+    if resume and os.path.exists(out):
+        checkpoint_rules, done, regrets[:], strategy[:] = load_tables(out)
+        if checkpoint_rules != rules_name:
+            raise ValueError("%s was trained for %s rules" % (out, checkpoint_rules))
+
+    counts = RawArray("q", workers)
+    processes = []
+    for i in range(workers):
+        n = iterations // workers + (i < iterations % workers)
+        process = multiprocessing.Process(
+            target=worker,
+            args=(regrets, strategy, counts, i, n, rules_name, policies, epsilon, int(time.time()) + i),
+        )
+        process.start()
+        processes.append(process)
+
+    start = time.perf_counter()
+    for process in processes:
+        while process.is_alive():
+            process.join(interval)
+            completed = sum(counts)
+            save_tables(out, rules_name, regrets, strategy, done + completed)
+            print(
+                "Iterations {0}/{1} | {2:.0f} rounds/s | checkpoint {3}".format(
+                    completed, iterations, completed / (time.perf_counter() - start), out
+                )
+            )
+    save_tables(out, rules_name, regrets, strategy, done + sum(counts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000, help="Rounds to train")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser.add_argument("--out", type=str, default="bidding.cfr", help="Checkpoint file")
+    parser.add_argument(
+        "--rules", type=str, choices=sorted(RULES), default="standard", help="Rule variant"
+    )
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    parser.add_argument("--discardai", type=str, default="lowest", help="Discard Round AI")
+    parser.add_argument("--cardai", type=str, default="basic", help="Card Round AI")
+    parser.add_argument(
+        "--epsilon", type=float, default=0.3, help="Exploration of the traversing seat"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=30.0, help="Seconds between checkpoints"
+    )
+    args = parser.parse_args()
+
+    train(
+        args.iterations,
+        args.workers,
+        args.out,
+        args.rules,
+        (args.discardai, args.cardai),
+        args.epsilon,
+        args.resume,
+        args.interval,
+    )
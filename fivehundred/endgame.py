@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""Endgame tablebase for the last tricks of a round.
+
+Every endgame with up to max_cards cards in each hand is solved exactly
+with all hands known, for trump contracts, no trumps and misere, and
+stored in a memory mapped file. Tablebase.lookup is then O(1) for a
+position at the start of a trick, Tablebase.solve searches the rest of
+the current trick and looks up the positions after it.
+
+Positions are canonical: cards are replaced by their rank order within
+their effective suit (only relative ranks decide tricks), seats are
+counted from the leader and the non-trump suits are interchangeable.
+Values are the tricks won by the leader's team, or by the misere player
+in misere.
+
+Only the 4-player partnership game is covered, the 3-team games have no
+single opponent to play against.
+
+    python fivehundred/endgame.py --cards 2 --out endgame.tb --check 1000
+"""
+import argparse
+import mmap
+import random
+import struct
+import time
+from array import array
+
+from game import Card, Deck
+
+TRUMPS = 0
+NO_TRUMPS = 1
+MISERE = 2
+
+CANONICAL_TRUMP = 0  # trump contracts are realized in spades
+
+# file header: magic, max cards, hash bits, positions
+HEADER = struct.Struct("<8sIIQ")
+MAGIC = b"500TB001"
+HASH = 0x9E3779B97F4A7C15
+
+
+def _suit_orders():
+    """Returns the deck cards of each effective suit strongest first, and
+    the power (rank order within the effective suit) of each card id, by
+    trump suit."""
+    deck = Deck().cards
+    orders = {}
+    powers = {}
+    for trump in Card.trumps:
+        values = Card.values[trump]
+        suits = Card.suits[trump]
+        by_suit = [[], [], [], []]
+        power = [None] * len(Card.cards)
+        for card in deck:
+            if suits[card.id] is not None:
+                by_suit[suits[card.id]].append(card)
+        for cards in by_suit:
+            cards.sort(key=lambda c: (values[c.id], Card.strengths[c.id]), reverse=True)
+            for i, card in enumerate(cards):
+                power[card.id] = i
+        orders[trump] = by_suit
+        powers[trump] = power
+    return orders, powers
+
+
+ORDERS, POWERS = _suit_orders()
+
+
+def position_key(hands, leader, trump, misere=None):
+    """Returns the canonical key of a position at the start of a trick.
+
+    Args:
+        hands (list): list of lists of Card objects held by each seat, the
+            misere partner's hand is ignored
+        leader (int): seat to lead
+        trump (int): trump suit, NoneType for no trumps and misere
+        misere (int): seat of the misere player, NoneType if not misere
+    """
+    suits = Card.suits[trump]
+    power = POWERS[trump]
+    partner = None if misere is None else (misere + 2) % 4
+    segments = [[], [], [], []]
+    joker = 0
+    for seat in range(4):
+        if seat == partner:
+            continue
+        rel = (seat - leader) % 4
+        for card in hands[seat]:
+            suit = suits[card.id]
+            if suit is None:  # joker in no trumps
+                joker = rel + 1
+            else:
+                segments[suit].append((power[card.id], rel))
+    segments = [tuple(rel for _, rel in sorted(segment)) for segment in segments]
+
+    if misere is not None:
+        mode, misere_rel = MISERE, (misere - leader) % 4
+    else:
+        mode, misere_rel = (TRUMPS if trump is not None else NO_TRUMPS), 0
+    if mode == TRUMPS:
+        trumps = segments.pop(trump)
+        segments = [trumps] + sorted(segments, key=lambda s: (len(s), s), reverse=True)
+    else:
+        segments.sort(key=lambda s: (len(s), s), reverse=True)
+
+    key = 1  # sentinel bit, keys of different lengths stay distinct
+    key = (key << 2 | mode) << 2 | misere_rel
+    key = key << 3 | joker
+    for segment in segments:
+        key = key << 4 | len(segment)
+        for rel in segment:
+            key = key << 2 | rel
+    return key
+
+
+class Search(object):
+    """Exact minimax over the remaining tricks of a position.
+
+    Args:
+        trump (int): trump suit, NoneType for no trumps and misere
+        misere (int): seat of the misere player, NoneType if not misere
+        probe (callable): returns the stored value of a position key,
+            NoneType if not stored
+        max_cards (int): largest hand size that may be stored
+    """
+
+    def __init__(self, trump, misere, probe, max_cards):
+        self.trump = trump
+        self.misere = misere
+        self.probe = probe
+        self.max_cards = max_cards
+        self.values = Card.values[trump]
+        self.suits = Card.suits[trump]
+        self.partner = None if misere is None else (misere + 2) % 4
+        self.size = 4 if misere is None else 3
+
+    def next_seat(self, seat):
+        seat = (seat + 1) % 4
+        if seat == self.partner:
+            seat = (seat + 1) % 4
+        return seat
+
+    def winner(self, cards, leader):
+        """Returns the seat winning a complete trick, see Trick.get_winner."""
+        lead_suit = self.suits[cards[0].id]
+        best = -1
+        winner = None
+        seat = leader
+        for card in cards:
+            value = self.values[card.id]
+            if not card.joker and card.suit == lead_suit:
+                value = max(value, Card.strengths[card.id] + 1)
+            if value > best:
+                best = value
+                winner = seat
+            seat = self.next_seat(seat)
+        return winner
+
+    def tricks(self, hands, leader, cards, ref):
+        """Returns the tricks still to be won by the team of ref, or by the
+        misere player in misere.
+
+        Args:
+            hands (list): list of lists of Card objects still held
+            leader (int): seat leading the current trick
+            cards (list): Card objects played in the current trick
+            ref (int): seat whose team is counted, ignored in misere
+        """
+        if len(cards) == self.size:
+            winner = self.winner(cards, leader)
+            if self.misere is None:
+                won = (winner - ref) % 2 == 0
+            else:
+                won = winner == self.misere
+            return won + self.tricks(hands, winner, [], ref)
+
+        if not cards:
+            k = len(hands[leader])
+            if k == 0:
+                return 0
+            if k <= self.max_cards:
+                value = self.probe(position_key(hands, leader, self.trump, self.misere))
+                if value is not None:
+                    if self.misere is None and (leader - ref) % 2:
+                        value = k - value
+                    return value
+
+        seat = leader
+        for _ in cards:
+            seat = self.next_seat(seat)
+        hand = hands[seat]
+        legal = hand
+        if cards:
+            lead_suit = self.suits[cards[0].id]
+            if lead_suit is not None:
+                legal = [card for card in hand if self.suits[card.id] == lead_suit] or hand
+        if self.misere is None:
+            maximize = (seat - ref) % 2 == 0
+        else:
+            maximize = seat != self.misere
+
+        best = None
+        for card in legal:
+            after = hands[:]
+            after[seat] = [c for c in hand if c is not card]
+            value = self.tricks(after, leader, cards + [card], ref)
+            if best is None or (value > best if maximize else value < best):
+                best = value
+        return best
+
+
+def _owner_tuples(length, counts):
+    """Yields the owner tuples of a suit segment within the seat counts."""
+    if length == 0:
+        yield ()
+        return
+    for seat, count in enumerate(counts):
+        if count:
+            counts[seat] -= 1
+            for rest in _owner_tuples(length - 1, counts):
+                yield (seat,) + rest
+            counts[seat] += 1
+
+
+def _segmentations(lengths, counts, i=0, previous=None, ordered_from=1):
+    """Yields canonical lists of segment owner tuples for segment lengths.
+
+    Segments from ordered_from on are interchangeable suits, kept in
+    descending (length, owners) order.
+    """
+    if i == len(lengths):
+        if not any(counts):
+            yield []
+        return
+    for owners in list(_owner_tuples(lengths[i], counts)):
+        if i > ordered_from and lengths[i] == lengths[i - 1] and owners > previous:
+            continue
+        for counter in owners:
+            counts[counter] -= 1
+        for rest in _segmentations(lengths, counts, i + 1, owners, ordered_from):
+            yield [owners] + rest
+        for counter in owners:
+            counts[counter] += 1
+
+
+def _partitions(n, parts, largest):
+    """Yields non-increasing tuples of parts lengths summing to n."""
+    if parts == 0:
+        if n == 0:
+            yield ()
+        return
+    for first in range(min(n, largest), -1, -1):
+        for rest in _partitions(n - first, parts - 1, first):
+            yield (first,) + rest
+
+
+def positions(k, mode, misere_rel=0):
+    """Yields realized canonical positions with k cards in each hand.
+
+    Args:
+        k (int): cards in each hand
+        mode (int): TRUMPS, NO_TRUMPS or MISERE
+        misere_rel (int): misere seat counted from the leader
+
+    Yields:
+        (hands, trump, misere) with seat 0 to lead
+    """
+    trump = CANONICAL_TRUMP if mode == TRUMPS else None
+    partner = (misere_rel + 2) % 4 if mode == MISERE else None
+    seats = [seat for seat in range(4) if seat != partner]
+    jokers = [0] if mode == TRUMPS else [0] + [seat + 1 for seat in seats]
+    order = ORDERS[trump]
+    # non-trump suits longest first, see position_key
+    if mode == TRUMPS:
+        suit_order = sorted((1, 2, 3), key=lambda s: -len(order[s]))
+    else:
+        suit_order = sorted(range(4), key=lambda s: -len(order[s]))
+
+    for joker in jokers:
+        counts = [k if seat in seats else 0 for seat in range(4)]
+        if joker:
+            counts[joker - 1] -= 1
+        n = sum(counts)
+
+        if mode == TRUMPS:
+            layouts = [
+                (trumps,) + rest
+                for trumps in range(n + 1)
+                for rest in _partitions(n - trumps, 3, n - trumps)
+            ]
+            ordered_from = 1
+        else:
+            layouts = list(_partitions(n, 4, n))
+            ordered_from = 0
+
+        for lengths in layouts:
+            suits = ([trump] if mode == TRUMPS else []) + suit_order
+            if any(length > len(order[suit]) for length, suit in zip(lengths, suits)):
+                continue
+            for segments in _segmentations(list(lengths), counts[:], 0, None, ordered_from):
+                hands = [[], [], [], []]
+                for segment, suit in zip(segments, suits):
+                    for card, seat in zip(order[suit], segment):
+                        hands[seat].append(card)
+                if joker:
+                    hands[joker - 1].append(Card(joker=True))
+                yield hands, trump, (misere_rel if mode == MISERE else None)
+
+
+def generate(max_cards, path, report=None):
+    """Solves every canonical endgame and writes the tablebase file.
+
+    Args:
+        max_cards (int): largest number of cards in each hand
+        path (str): output file
+        report (callable): called with (cards, positions, seconds) per hand
+            size
+    """
+    table = {}
+    for k in range(1, max_cards + 1):
+        start = time.perf_counter()
+        count = len(table)
+        configs = [(TRUMPS, 0), (NO_TRUMPS, 0)] + [(MISERE, rel) for rel in (0, 1, 3)]
+        for mode, misere_rel in configs:
+            for hands, trump, misere in positions(k, mode, misere_rel):
+                key = position_key(hands, 0, trump, misere)
+                if key in table:
+                    continue
+                search = Search(trump, misere, table.get, k - 1)
+                table[key] = search.tricks(hands, 0, [], 0)
+        if report is not None:
+            report(k, len(table) - count, time.perf_counter() - start)
+    write(path, max_cards, table)
+    return len(table)
+
+
+def write(path, max_cards, table):
+    """Writes positions as an open addressing hash table.
+
+    Notes:
+        Layout: header, then 2 ** bits keys (uint64, 0 for empty), then
+        2 ** bits values (uint8). The table is at most half full.
+    """
+    bits = max(len(table) * 2 - 1, 1).bit_length()
+    size = 1 << bits
+    keys = array("Q", bytes(8 * size))
+    values = bytearray(size)
+    mask = size - 1
+    for key, value in table.items():
+        slot = (key * HASH & 0xFFFFFFFFFFFFFFFF) >> (64 - bits)
+        while keys[slot]:
+            slot = (slot + 1) & mask
+        keys[slot] = key
+        values[slot] = value
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, max_cards, bits, len(table)))
+        f.write(keys.tobytes())
+        f.write(values)
+
+
+class Tablebase(object):
+    """Memory mapped endgame tablebase.
+
+    Args:
+        path (str): file written by generate
+
+    Attributes:
+        max_cards (int): largest number of cards in each hand stored
+        positions (int): number of positions stored
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_cards, self.bits, self.positions = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not an endgame tablebase" % path)
+        self._mask = (1 << self.bits) - 1
+        self._values = HEADER.size + 8 * (1 << self.bits)
+
+    def __reduce__(self):
+        return Tablebase, (self.path,)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def probe(self, key):
+        """Returns the value stored for a position key, NoneType if none."""
+        slot = (key * HASH & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+        while True:
+            (stored,) = struct.unpack_from("<Q", self._map, HEADER.size + 8 * slot)
+            if stored == key:
+                return self._map[self._values + slot]
+            if not stored:
+                return None
+            slot = (slot + 1) & self._mask
+
+    def lookup(self, hands, leader, trump, misere=None):
+        """Returns the tricks won by the leader's team, or by the misere
+        player, from a position at the start of a trick.
+
+        Args:
+            hands (list): list of lists of Card objects held by each seat
+            leader (int): seat to lead
+            trump (int): trump suit, NoneType for no trumps and misere
+            misere (int): seat of the misere player, NoneType if not misere
+
+        Returns:
+            tricks, NoneType if the position is not stored
+        """
+        return self.probe(position_key(hands, leader, trump, misere))
+
+    def solve(self, hands, leader, trump, cards=(), misere=None, seat=None):
+        """Returns the tricks still to be won from a position in a trick.
+
+        Notes:
+            Searches the current trick, the positions after it must have
+            at most max_cards in each hand.
+
+        Args:
+            hands (list): list of lists of Card objects still held
+            leader (int): seat leading the current trick
+            trump (int): trump suit, NoneType for no trumps and misere
+            cards (list): Card objects played in the current trick
+            misere (int): seat of the misere player, NoneType if not misere
+            seat (int): seat whose team's tricks are counted, the leader if
+                NoneType, ignored in misere
+
+        Returns:
+            tricks won by the team of seat, or by the misere player
+        """
+        search = Search(trump, misere, self.probe, self.max_cards)
+        return search.tricks(hands, leader, list(cards), leader if seat is None else seat)
+
+
+def check(tablebase, n, rng=random):
+    """Compares lookups with a full search on random deals.
+
+    Raises:
+        AssertionError: on the first mismatch
+    """
+    for _ in range(n):
+        k = rng.randint(1, tablebase.max_cards)
+        trump = rng.choice(Card.trumps)
+        misere = rng.choice([None, None, rng.randrange(4)]) if trump is None else None
+        leader = rng.randrange(4)
+        if misere is not None and leader == (misere + 2) % 4:
+            leader = misere
+        deck = Deck().cards
+        rng.shuffle(deck)
+        hands = [deck[seat * k : (seat + 1) * k] for seat in range(4)]
+        if misere is not None:
+            hands[(misere + 2) % 4] = []
+
+        expected = Search(trump, misere, lambda key: None, 0).tricks(hands, leader, [], leader)
+        assert tablebase.lookup(hands, leader, trump, misere) == expected, (hands, trump, misere)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=2, help="Largest number of cards in each hand")
+    parser.add_argument("--out", type=str, default="endgame.tb", help="Tablebase file")
+    parser.add_argument("--check", type=int, default=0, help="Random deals to check")
+    args = parser.parse_args()
+
+    def report(k, count, seconds):
+        print("Cards {0} | {1} positions | {2:.1f}s".format(k, count, seconds))
+
+    total = generate(args.cards, args.out, report)
+    print("Positions     :", total)
+    if args.check:
+        tablebase = Tablebase(args.out)
+        start = time.perf_counter()
+        check(tablebase, args.check)
+        print("Check         : ok (%.1fs)" % (time.perf_counter() - start))
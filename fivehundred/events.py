@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Game events and subscribers.
+
+The engine emits events on an EventBus. Events are only constructed when
+there is at least one subscriber, and hold references to engine objects so
+that subscribers do any formatting themselves.
+"""
+import json
+from collections import Counter, namedtuple
+
+RoundStarted = namedtuple("RoundStarted", "round dealer")
+Deal = namedtuple("Deal", "round hands kitty")
+HandsShown = namedtuple("HandsShown", "players kitty")
+PhaseStarted = namedtuple("PhaseStarted", "phase")
+BidMade = namedtuple("BidMade", "seat bid")
+BiddingComplete = namedtuple("BiddingComplete", "seat bid bids")
+KittyTaken = namedtuple("KittyTaken", "seat cards")
+Discard = namedtuple("Discard", "seat cards")
+CardPlayed = namedtuple("CardPlayed", "trick seat card")
+TrickWon = namedtuple("TrickWon", "trick tricks_won")
+RoundScored = namedtuple("RoundScored", "round scores game_scores status")
+
+
+class EventBus(object):
+    """Dispatches events to subscribers.
+
+    Attributes:
+        subscribers (list): list of (callback, event types) tuples
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def __bool__(self):
+        return bool(self.subscribers)
+
+    def __reduce__(self):
+        # subscribers hold open files and connections, a pickled bus is empty
+        return EventBus, ()
+
+    def subscribe(self, callback, *types):
+        """Subscribes a callback to the given event types, or all events.
+
+        Args:
+            callback (callable): called with each event
+            types (type): event types, all events if none given
+        """
+        self.subscribers.append((callback, types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Removes all subscriptions of a callback."""
+        self.subscribers = [s for s in self.subscribers if s[0] is not callback]
+
+    def emit(self, type_, *args):
+        """Constructs and dispatches an event if anyone is listening.
+
+        Args:
+            type_ (type): event type
+            args: event fields
+        """
+        if not self.subscribers:
+            return
+        event = type_(*args)
+        for callback, types in self.subscribers:
+            if not types or type_ in types:
+                callback(event)
+
+
+def encode(value):
+    """Converts engine objects in an event field to JSON types."""
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    if hasattr(value, "code"):  # Card
+        return value.code()
+    if hasattr(value, "winner"):  # Trick
+        return {
+            "number": value.number,
+            "lead": value.lead,
+            "winner": value.winner,
+            "cards": encode(value.cards),
+        }
+    if hasattr(value, "cards"):  # Deck, Hand
+        return encode(value.cards)
+    if hasattr(value, "pass_"):  # Bid
+        return str(value)
+    return value
+
+
+class ConsoleRenderer(object):
+    """Prints events as human readable game narration.
+
+    Args:
+        game (Game): game whose player labels are used
+        human (int): index of human player whose hand is shown, all hands
+            are shown if NoneType
+    """
+
+    def __init__(self, game, human=None):
+        self.game = game
+        self.human = human
+
+    def label(self, seat):
+        return self.game.players[seat].label
+
+    def __call__(self, event):
+        handler = getattr(self, "on_" + type(event).__name__, None)
+        if handler is not None:
+            handler(event)
+
+    def on_RoundStarted(self, event):
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        print("Round %s" % (event.round))
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+
+    def on_HandsShown(self, event):
+        for index, player in enumerate(event.players):
+            if self.human == index or self.human is None:
+                print(player.label, player)
+        if self.human is None:
+            print(event.kitty.label, event.kitty)
+
+    def on_PhaseStarted(self, event):
+        print("\n========================================")
+        print("Begin %s" % event.phase)
+        print("========================================")
+
+    def on_BiddingComplete(self, event):
+        print("\n--------------------------")
+        if event.seat is None:
+            print("Bidding complete - all passed")
+        else:
+            print("Bidding complete")
+            print(self.label(event.seat), "-", event.bid)
+            print("|".join([str(bid) for bid in event.bids]))
+        print("--------------------------")
+
+    def on_TrickWon(self, event):
+        trick = event.trick
+        print("\n--------------------------")
+        print("Trick         :", trick.number + 1)
+        print("Cards Played  :", trick)
+        print("Lead          :", self.label(trick.lead))
+        print("Winner        :", self.label(trick.winner))
+        print("Trick Count   :", event.tricks_won)
+        print("--------------------------")
+
+    def on_RoundScored(self, event):
+        print("\n--------------------------")
+        print("Round {0} complete".format(event.round))
+        print("Round Score: ", event.scores)
+        print("Game Scores: ", event.game_scores)
+        print("Game Status: ", event.status)
+        print("--------------------------")
+
+
+class JsonLogWriter(object):
+    """Writes events as JSON lines.
+
+    Args:
+        f (file): open text file to write to
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, event):
+        record = {"event": type(event).__name__}
+        for field, value in zip(event._fields, event):
+            record[field] = encode(value)
+        self.f.write(json.dumps(record) + "\n")
+
+
+class Metrics(object):
+    """Counts events and contract outcomes.
+
+    Attributes:
+        counts (Counter): number of events by type name
+        contracts (Counter): contracts by bid string
+        contracts_made (Counter): contracts made by bid string
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.contracts = Counter()
+        self.contracts_made = Counter()
+        self._contract = None
+
+    def __call__(self, event):
+        self.counts[type(event).__name__] += 1
+        if type(event) is BiddingComplete:
+            self._contract = (event.seat, str(event.bid)) if event.seat is not None else None
+        elif type(event) is RoundScored and self._contract is not None:
+            seat, bid = self._contract
+            self.contracts[bid] += 1
+            self.contracts_made[bid] += event.scores[seat % len(event.scores)] > 0
+
+
+class TrainingCollector(object):
+    """Collects the decisions of each round with the final round scores.
+
+    Attributes:
+        records (list): list of (seat, event, round scores) tuples for
+            completed rounds
+    """
+
+    def __init__(self):
+        self.records = []
+        self._pending = []
+
+    def __call__(self, event):
+        if type(event) in (BidMade, Discard, CardPlayed):
+            self._pending.append((event.seat, event))
+        elif type(event) is RoundScored:
+            self.records.extend(
+                (seat, decision, event.scores) for seat, decision in self._pending
+            )
+            self._pending = []
@@ -1,37 +1,109 @@
 # -*- coding: utf-8 -*-
 import argparse
+import os
 import random
-
-from ai import Policy
+import struct
+import tempfile
+import weakref
+from array import array
+
+from ai import Policy, Ponderer
+from events import (
+    BidMade,
+    BiddingComplete,
+    CardPlayed,
+    ConsoleRenderer,
+    Deal,
+    Discard,
+    EventBus,
+    HandsShown,
+    JsonLogWriter,
+    KittyTaken,
+    PhaseStarted,
+    RoundScored,
+    RoundStarted,
+    TrickWon,
+)
+from knowledge import Knowledge
+
+# module level state, overridden when run as a script
+trump_suit = None
+HUMAN_PLAYER = None
 
 
 class Card(object):
     """Represents a standard playing card including Joker.
 
+    Notes:
+        Cards are interned, Card(suit, rank) always returns the same
+        instance. Values, bowers and effective suits are looked up in tables
+        precomputed for each trump suit.
+
+        Ranks 13-15 are the 11s, 12s and 13s of the 6-player deck, which
+        rank between the ten and the jack, see Card.strengths.
+
     Args:
         suit (int): int representation of card suit [0-3]
-        rank (int): int representation of card rank [0-12]
+        rank (int): int representation of card rank [0-15]
         joker (bool): indicates joker
 
     Attributes:
         suit (int): directly passed from arg
         rank (int): directly passed from arg
         joker (bool): directly passed from arg
+        id (int): card id - suit * 13 + rank, 52 for the joker, 53-64 for
+            the 6-player cards
     """
 
+    __slots__ = ("suit", "rank", "joker", "id")
+
     suit_names = ["S", "C", "D", "H"]
     suit_colours = ["B", "B", "R", "R"]
     rank_names = ["2", "3", "4", "5", "6", "7", "8", "9", "T", "J", "Q", "K", "A"]
+    rank_names += ["11", "12", "13"]
+    trumps = [0, 1, 2, 3, None]
+
+    cards = [None] * 65  # interned cards by id
 
-    def __init__(self, suit=None, rank=None, joker=False):
-        self.suit = suit
-        self.rank = rank
-        self.joker = joker
+    def __new__(cls, suit=None, rank=None, joker=False):
+        if joker:
+            card_id = 52
+        elif rank < 13:
+            card_id = suit * 13 + rank
+        else:
+            card_id = 53 + suit * 3 + rank - 13
+        card = Card.cards[card_id]
+        if card is None:
+            card = object.__new__(cls)
+            card.suit = suit
+            card.rank = rank
+            card.joker = joker
+            card.id = card_id
+            Card.cards[card_id] = card
+        return card
+
+    def __reduce__(self):
+        return Card.from_id, (self.id,)
+
+    @staticmethod
+    def from_id(card_id):
+        """Returns the card for a card id."""
+        if card_id == 52:
+            return Card(joker=True)
+        elif card_id > 52:
+            return Card((card_id - 53) // 3, (card_id - 53) % 3 + 13)
+        return Card(card_id // 13, card_id % 13)
 
     def __str__(self):
         """Returns unicode (graphical) representation of card"""
+        return Card.glyphs[self.id]
+
+    def glyph(self):
+        """Builds unicode (graphical) representation of card"""
         if self.joker:
             return u"\U0001F0CF"
+        elif self.rank > 12:  # no unicode cards for 11s, 12s and 13s
+            return self.code()
         else:
             return chr(
                 int(
@@ -46,20 +118,20 @@ class Card(object):
                 )
             )
 
+    def code(self):
+        """Returns plain text representation of card, e.g. TS, JH, JK"""
+        if self.joker:
+            return "JK"
+        return Card.rank_names[self.rank] + Card.suit_names[self.suit]
+
     def __lt__(self, other):
-        """Compares this card to other, first by suit, then rank"""
-        val1 = self.value(), self.suit, self.rank
-        val2 = other.value(), other.suit, other.rank
-        return val1 < val2
+        """Compares this card to other, first by value, then suit, then rank"""
+        keys = Card.sort_keys[trump_suit]
+        return keys[self.id] < keys[other.id]
 
     def bower(self):
         """Returns bower type"""
-        if trump_suit is not None:
-            if self.rank == 9:
-                if trump_suit == self.suit:
-                    return "Right"
-                elif Card.suit_colours[trump_suit] == Card.suit_colours[self.suit]:
-                    return "Left"
+        return Card.bowers[trump_suit][self.id]
 
     def value(self):
         """Value of card according to current trump suit
@@ -71,41 +143,94 @@ class Card(object):
             100-199 - Trumps
             0       - Off-suit / No trumps
         """
+        return Card.values[trump_suit][self.id]
+
+    def effective_suit(self):
+        """Suit the card follows, joker and bowers are trumps"""
+        return Card.suits[trump_suit][self.id]
+
+    def _bower(self, trump):
+        if trump is not None:
+            if self.rank == 9:
+                if trump == self.suit:
+                    return "Right"
+                elif Card.suit_colours[trump] == Card.suit_colours[self.suit]:
+                    return "Left"
 
+    def _value(self, trump):
         if self.joker:  # joker always highest
             return 400
-        elif trump_suit is None:  # no trumps
+        elif trump is None:  # no trumps
             return 0
-        elif self.bower() == "Right":  # right bower
+        elif self._bower(trump) == "Right":  # right bower
             return 300
-        elif self.bower() == "Left":  # left bower
+        elif self._bower(trump) == "Left":  # left bower
             return 200
-        elif trump_suit == self.suit:  # other trumps
-            return self.rank + 100
+        elif trump == self.suit:  # other trumps
+            return Card.strengths[self.id] + 100
         else:
             return 0
 
+    @staticmethod
+    def build_tables():
+        """Precomputes the card lookup tables for each trump suit."""
+        cards = [Card.from_id(i) for i in range(len(Card.cards))]
+        # rank order within a suit, 11s, 12s and 13s between ten and jack
+        Card.strengths = [
+            None if card.joker else (card.rank, card.rank + 3, card.rank - 4)[
+                (card.rank > 8) + (card.rank > 12)
+            ]
+            for card in cards
+        ]
+        Card.glyphs = [card.glyph() for card in cards]
+        Card.bowers = {t: [card._bower(t) for card in cards] for t in Card.trumps}
+        Card.values = {t: [card._value(t) for card in cards] for t in Card.trumps}
+        Card.suits = {
+            t: [
+                t if card.joker or card._bower(t) is not None else card.suit
+                for card in cards
+            ]
+            for t in Card.trumps
+        }
+        # (value, suit, rank) ordering packed into an int
+        Card.sort_keys = {
+            t: [
+                card._value(t) * 100
+                + (99 if card.joker else card.suit * 16 + Card.strengths[card.id])
+                for card in cards
+            ]
+            for t in Card.trumps
+        }
+
+
+Card.build_tables()
+
 
 class Deck(object):
     """Represents a deck of cards.
 
     Notes:
-        4-player 43-card deck including Joker
+        4-player 43-card deck including Joker, unless other rules given
+
+    Args:
+        rules (Rules): rule set giving the deck, 4-player rules if NoneType
 
     Attributes:
       cards (list): list of Card objects
     """
 
-    def __init__(self):
-        self.cards = []
-        for suit in range(4):
-            for rank in range(2, 13):
-                if rank > 2 or suit > 1:  # 4-player deck
-                    card = Card(suit, rank)
-                    self.cards.append(card)
-        # add joker
-        joker = Card(joker=True)
-        self.cards.append(joker)
+    __slots__ = ("cards",)
+
+    card_ids = [
+        suit * 13 + rank
+        for suit in range(4)
+        for rank in range(2, 13)
+        if rank > 2 or suit > 1  # 4-player deck
+    ] + [52]  # add joker
+
+    def __init__(self, rules=None):
+        card_ids = Deck.card_ids if rules is None else rules.deck_ids
+        self.cards = [Card.cards[i] for i in card_ids]
 
     def __str__(self):
         res = [str(card) for card in self.cards]
@@ -167,6 +292,8 @@ class Hand(Deck):
       possible_index (list): hand index of possible
     """
 
+    __slots__ = ("label", "possible", "possible_index")
+
     def __init__(self, label=""):
         self.label = label
         self.cards = []
@@ -184,14 +311,12 @@ class Hand(Deck):
 
         # append cards in hand of lead suit
         if trick.lead_suit is not None:
-            for card in self.cards:
-                # joker and bowers should be trump suit
-                test_suit = card.suit
-                if card.joker or card.bower() is not None:
-                    test_suit = trump_suit
-                if test_suit == trick.lead_suit:
+            # joker and bowers should be trump suit
+            suits = Card.suits[trump_suit]
+            for i, card in enumerate(self.cards):
+                if suits[card.id] == trick.lead_suit:
                     self.possible.append(card)
-                    self.possible_index.append(self.cards.index(card))
+                    self.possible_index.append(i)
 
         # all cards if cannot follow suit
         if not self.possible:
@@ -202,6 +327,10 @@ class Hand(Deck):
 class Bid(object):
     """Represents a bid.
 
+    Notes:
+        Bids are interned, Bid(text) always returns the same instance for a
+        bid string. Points are precomputed.
+
     Attributes:
       bid (str): bid string - ([6-10][SCDHN]|[OM|CM])
       pass_ (bool): indicates a pass bid
@@ -210,16 +339,31 @@ class Bid(object):
       suit (int): suit of bid - [0-3], NoneType for no trumps
       valid (bool): indicates a valid bid
       misere (bool): indicates a misere bid
+      id (int): 0 for a pass, otherwise 1 + index in Bid.possible
     """
 
+    __slots__ = ("bid", "pass_", "tricks", "suit_rank", "suit", "valid", "misere", "id", "_points")
+
     possible = []
     for trick in range(6, 11):
         for suit in range(5):
             possible.append("%s%s" % (trick, "SCDHN"[suit]))
     possible.insert(possible.index("8C"), "CM")
     possible.insert(possible.index("10N"), "OM")
+    del trick, suit
+
+    bids = {}  # interned bids by bid string, NoneType for pass
+
+    def __new__(cls, bid=None):
+        try:
+            return Bid.bids[bid or None]
+        except KeyError:
+            pass
+
+        if bid and bid.upper() in Bid.bids:
+            return Bid.bids[bid.upper()]
 
-    def __init__(self, bid=None):
+        self = object.__new__(cls)
         self.bid = None
         self.pass_ = False
         self.tricks = None
@@ -227,6 +371,7 @@ class Bid(object):
         self.suit = None
         self.valid = True
         self.misere = None
+        self.id = None
 
         if bid:
             # clean up bid
@@ -234,6 +379,7 @@ class Bid(object):
 
             if bid in Bid.possible:
                 self.bid = bid
+                self.id = Bid.possible.index(bid) + 1
                 if bid in ("OM", "CM"):
                     self.misere = bid
 
@@ -243,14 +389,21 @@ class Bid(object):
                     self.suit_rank = "SCDHN".index(bid[-1])
                     if self.suit_rank < 4:
                         self.suit = self.suit_rank
+                Bid.bids[bid] = self
             else:
                 self.valid = False
         else:
             self.pass_ = True
+            self.id = 0
+            Bid.bids[None] = self
+        self._points = self._get_points()
+        return self
 
-    def points(self):
-        """Returns the number of points for bid."""
-        if self.pass_:
+    def __reduce__(self):
+        return Bid, (self.bid,)
+
+    def _get_points(self):
+        if self.pass_ or not self.valid:
             return 0
 
         if self.bid == "OM":
@@ -260,84 +413,198 @@ class Bid(object):
         else:
             return ((self.tricks - 6) * 100) + (self.suit_rank * 20) + (40)
 
+    def points(self):
+        """Returns the number of points for bid."""
+        return self._points
+
     def __str__(self):
         if self.bid:
             return self.bid
         else:
             return "Ps"
 
-    def __lt__(self, other):
-        """Compares this bid to other by points.
 
-        Notes:
-            Open misere beats 10H
-        """
-        if self.bid == "OM":
-            return self.points() + 1 < other.points()
-        if other.bid == "OM":
-            return self.points() - 1 < other.points()
+Bid.ladder = [Bid(None)] + [Bid(bid) for bid in Bid.possible]
+
+
+class Rules(object):
+    """A rule set compiled into lookup tables.
+
+    Args:
+        players (int): number of players - 3, 4 or 6
+        misere (bool): misere bids allowed
+        scoring (str): bid point schedule - 'avondale' or 'original'
+        finish (int): game ends when a team score reaches +/- finish
+
+    Attributes:
+        players (int): directly passed from arg
+        teams (int): number of teams, partners sit opposite
+        partner (int): seat offset of partner, NoneType for no partners
+        hand_size (int): cards dealt to each player
+        tricks (int): tricks per round
+        finish (int): directly passed from arg
+        deck_ids (list): card ids of the deck
+        possible (list): bid strings of the bid ladder in ascending order
+        order (list): ladder position by bid id, 0 for pass, NoneType for
+            bids not allowed
+        points (list): points by bid id
+        suits (dict): effective suit by card id for each trump suit
+    """
+
+    def __init__(self, players=4, misere=True, scoring="avondale", finish=500):
+        self.players = players
+        self.teams = 2 if players == 4 else 3
+        self.partner = players // 2 if self.teams < players else None
+        self.hand_size = 10
+        self.tricks = 10
+        self.finish = finish
+
+        # deck, 10 cards each and 3 in the kitty
+        if players == 3:
+            ranks = {suit: range(5, 13) for suit in range(4)}  # 7s up
+        elif players == 4:
+            ranks = {suit: range(2 + (suit < 2), 13) for suit in range(4)}
+        elif players == 6:
+            ranks = {suit: list(range(13)) + [13, 14] + [15] * (suit > 1) for suit in range(4)}
+        else:
+            raise ValueError("Unsupported number of players: %s" % players)
+        self.deck_ids = [Card(suit, rank).id for suit in range(4) for rank in ranks[suit]]
+        self.deck_ids.append(Card(joker=True).id)
+
+        # bid ladder ordered by points, open misere beats 10H
+        if scoring == "avondale":
+            points = lambda bid: ((bid.tricks - 6) * 100) + (bid.suit_rank * 20) + 40
+        elif scoring == "original":
+            points = lambda bid: (bid.tricks - 5) * (bid.suit_rank * 20 + 40)
         else:
-            return self.points() < other.points()
+            raise ValueError("Unknown scoring: %s" % scoring)
+
+        self.points = [0] * len(Bid.ladder)
+        keys = {}
+        for bid in Bid.ladder[1:]:
+            if bid.misere is None:
+                self.points[bid.id] = points(bid)
+                keys[bid] = (self.points[bid.id], bid.tricks)
+            elif misere:
+                self.points[bid.id] = bid.points()
+                keys[bid] = (bid.points(), 0 if bid.bid == "CM" else 11)
+        ladder = sorted(keys, key=keys.get)
+        self.possible = [bid.bid for bid in ladder]
+        self.order = [None] * len(Bid.ladder)
+        self.order[0] = 0
+        for position, bid in enumerate(ladder):
+            self.order[bid.id] = position + 1
+
+        self.suits = Card.suits
+
+    def team(self, seat):
+        """Returns the team index of a seat."""
+        return seat % self.teams
+
+    def highest_bid(self, bids):
+        """Returns the highest of a list of Bid objects on the ladder, pass
+        if there are none."""
+        return max(bids, key=lambda bid: self.order[bid.id] or 0, default=Bid.ladder[0])
+
+
+RULES = {
+    "standard": Rules(),
+    "three": Rules(players=3),
+    "six": Rules(players=6),
+    "no-misere": Rules(misere=False),
+    "original": Rules(scoring="original"),
+}
 
 
 class Round(object):
     """Represents a round.
 
+    Args:
+        number (int): round number
+        dealer (int): index of current dealer for round
+        rules (Rules): rule set, standard 4-player rules if NoneType
+
     Attributes:
         number (int): round number
         dealer (int): index of current dealer for round
-        turn (int): index of current turn within round - [0-3]
+        rules (Rules): rule set of round
+        turn (int): index of current turn within round
         status (str): status of round
         starting_hands(list): list of lists of Card objects
         bids (list): list of bids made
         passes (list): list of passed bids made
         highest_bid (Bid): winning bid for round
-        possible_bids (Bid.possible)
+        possible_bids (list): bid strings still possible, see Rules.possible
         tricks (list): list of Trick objects played
         tricks_won (list): team tricks tally for round
         scores (list) : team scores for round
+        knowledge (list): Knowledge object of each player for card play
     """
 
-    def __init__(self, number, dealer):
+    __slots__ = (
+        "number",
+        "dealer",
+        "rules",
+        "turn",
+        "status",
+        "starting_hands",
+        "bids",
+        "passes",
+        "highest_bid",
+        "trump_suit",
+        "highest_bidder",
+        "possible_bids",
+        "tricks",
+        "tricks_won",
+        "scores",
+        "knowledge",
+    )
+
+    def __init__(self, number, dealer, rules=None):
         # general
         self.number = number
         self.dealer = dealer
+        self.rules = rules if rules is not None else RULES["standard"]
         self.turn = None
         self.status = "Bidding in progress"
         self.starting_hands = []
 
         # bids
         self.bids = []
-        self.passes = [None, None, None, None]
+        self.passes = [None] * self.rules.players
         self.highest_bid = Bid()
         self.trump_suit = None
         self.highest_bidder = None
-        self.possible_bids = Bid.possible
+        self.possible_bids = self.rules.possible
 
         # tricks
         self.tricks = []
-        self.tricks_won = [0, 0]
-        self.scores = [0, 0]
+        self.tricks_won = [0] * self.rules.teams
+        self.scores = [0] * self.rules.teams
+        self.knowledge = None
 
     def __str__(self):
         pass
 
     def increment_turn(self):
         """Updates turn by one. Cycles through players."""
-        self.turn = (self.turn + 1) % 4
+        players = self.rules.players
+        self.turn = (self.turn + 1) % players
 
         # skip misere partner
-        if self.status == "Card play in progress":
-            if self.highest_bid.misere and self.turn == (self.highest_bidder + 2) % 4:
-                self.turn = (self.turn + 1) % 4
+        if self.status == "Card play in progress" and self.rules.partner:
+            partner = (self.highest_bidder + self.rules.partner) % players
+            if self.highest_bid.misere and self.turn == partner:
+                self.turn = (self.turn + 1) % players
 
     def update_status(self):
         """Updates the status for round."""
         if self.status == "Bidding in progress":
-            if len(self.bids) >= 4:
-                if self.passes.count(True) == 4:
+            players = self.rules.players
+            if len(self.bids) >= players:
+                if self.passes.count(True) == players:
                     self.status = "Bidding all passed"
-                elif self.passes.count(True) == 3:
+                elif self.passes.count(True) == players - 1:
                     self.status = "Bidding complete"
             else:
                 self.status = "Bidding in progress"
@@ -348,7 +615,8 @@ class Round(object):
         Args:
             bid (Bid): Bid object
         """
-        if not bid.valid:
+        order = self.rules.order
+        if not bid.valid or order[bid.id] is None:
             print("Not a valid bid")
         else:
             if bid.pass_:
@@ -356,16 +624,14 @@ class Round(object):
                 self.passes[self.turn] = True
                 self.increment_turn()
             else:
-                if bid > self.highest_bid:
+                if order[bid.id] > order[self.highest_bid.id]:
                     self.bids.append(bid)
                     self.highest_bid = bid
                     self.highest_bidder = self.turn
                     self.increment_turn()
-                    self.possible_bids = Bid.possible[
-                        Bid.possible.index(str(bid)) + 1 :
-                    ]
+                    self.possible_bids = self.rules.possible[order[bid.id] :]
                 else:
-                    print(bid.points(), self.highest_bid.points())
+                    print(self.points(bid), self.points(self.highest_bid))
                     print("Current bid must be higher than", self.highest_bid)
 
     def play_card(self, player, hand_index, trick):
@@ -385,32 +651,48 @@ class Round(object):
                 else:
                     print("Need to follow suit")
             else:
-                if card.joker or card.bower() is not None:
-                    trick.lead_suit = trump_suit
-                else:
-                    trick.lead_suit = card.suit
+                trick.lead_suit = card.effective_suit()
                 player.move_cards(trick, [card])
                 self.increment_turn()
 
         except:
             print("Card not present")
 
+    def start_knowledge(self, players, discard):
+        """Sets up card counting for each player before card play.
+
+        Args:
+            players (list): list of Hand objects of the players
+            discard (list): list of Card objects discarded by the bidder
+        """
+        deck = Deck(self.rules).cards
+        self.knowledge = [
+            Knowledge(i, player.cards, deck, self.trump_suit, players=len(players))
+            for i, player in enumerate(players)
+        ]
+        self.knowledge[self.highest_bidder].see(discard)
+
+    def points(self, bid):
+        """Returns the number of points for bid under the round rules."""
+        return self.rules.points[bid.id]
+
     def set_scores(self):
         """Sets the scores at the end of round."""
-        bid_team = self.highest_bidder % 2
-        off_team = (self.highest_bidder + 1) % 2
+        bid_team = self.rules.team(self.highest_bidder)
 
         if self.highest_bid.misere:  # misere
             bid_made = self.tricks_won[bid_team] == 0
         else:  # non-misere
             bid_made = self.tricks_won[bid_team] >= self.highest_bid.tricks
-            self.scores[off_team] += self.tricks_won[off_team] * 10
+            for off_team in range(self.rules.teams):
+                if off_team != bid_team:
+                    self.scores[off_team] += self.tricks_won[off_team] * 10
 
         # increment major scores
         if bid_made:
-            self.scores[bid_team] += self.highest_bid.points()
+            self.scores[bid_team] += self.points(self.highest_bid)
         else:
-            self.scores[bid_team] -= self.highest_bid.points()
+            self.scores[bid_team] -= self.points(self.highest_bid)
 
 
 class Trick(Deck):
@@ -418,20 +700,27 @@ class Trick(Deck):
 
     Args:
         lead (int): player index of lead player
+        number (int): trick number in round
         misere: indicates a misere player
+        rules (Rules): rule set, standard 4-player rules if NoneType
 
     Attributes:
         lead (int): player index of lead player
+        number (int): trick number in round
         misere (int): player index of misere player
+        rules (Rules): rule set of trick
         lead_suit (int): suit index of suit led
         winner (int): player index of trick winner
         cards (list): list of Card objects played in trick
     """
 
-    def __init__(self, lead, number, misere=None):
+    __slots__ = ("lead", "number", "misere", "rules", "lead_suit", "winner")
+
+    def __init__(self, lead, number, misere=None, rules=None):
         self.lead = lead
         self.number = number
         self.misere = misere
+        self.rules = rules if rules is not None else RULES["standard"]
         self.lead_suit = None
         self.winner = None
         self.cards = []
@@ -442,22 +731,25 @@ class Trick(Deck):
 
     def get_winner(self):
         """Gets the current winning card index"""
-        card_values = dict(zip(range(4), [-1] * 4))
+        players = self.rules.players
+        partner = self.rules.partner
+        card_values = dict(zip(range(players), [-1] * players))
         player_index = self.lead
 
         if len(self.cards) > 0:
             for card in self.cards:
+                # a card following suit beats any off-suit card, even a 2
                 try:
-                    lead_value = (card.suit == self.lead_suit) * card.rank
+                    lead_value = (card.suit == self.lead_suit) * (Card.strengths[card.id] + 1)
                 except TypeError:
                     lead_value = 0
 
-                if self.misere is not None:
-                    if (self.misere + 2) % 4 == player_index:
-                        player_index = (player_index + 1) % 4
+                if self.misere is not None and partner:
+                    if (self.misere + partner) % players == player_index:
+                        player_index = (player_index + 1) % players
 
                 card_values[player_index] = max(lead_value, card.value())
-                player_index = (player_index + 1) % 4
+                player_index = (player_index + 1) % players
 
             return max(card_values, key=card_values.get)
         else:
@@ -470,14 +762,215 @@ class Trick(Deck):
 
     def is_complete(self):
         """Returns whether all players have played their cards in trick"""
-        return len(self.cards) + (self.misere is not None) == 4
+        sitting_out = self.misere is not None and self.rules.partner is not None
+        return len(self.cards) + sitting_out == self.rules.players
+
+
+class RoundHistory(object):
+    """Completed rounds stored as compact packed records.
+
+    Notes:
+        Rounds are packed when appended and materialized as Round and Trick
+        objects again only when indexed. With max_rounds set, the oldest
+        records are spilled to a file on disk. The spill file is closed,
+        and removed if temporary, by close or once the history is garbage
+        collected or the interpreter exits. After close spilled records
+        can no longer be read and no more rounds can be appended.
+
+        Record layout: header (see RoundHistory.header), card ids of the
+        starting hands and kitty, bid ids, then per trick the lead, winner,
+        number of cards and card ids, then tricks won and scores per team.
+
+    Args:
+        rules (Rules): rule set of the rounds
+        max_rounds (int): number of records kept in memory, all if NoneType
+        spill_path (str): file for spilled records, a temporary file if
+            NoneType
+
+    Attributes:
+        records (list): packed records in memory
+        spilled (int): number of records spilled to disk
+        closed (bool): whether the history was closed
+    """
+
+    __slots__ = (
+        "rules",
+        "max_rounds",
+        "spill_path",
+        "records",
+        "offsets",
+        "closed",
+        "_spill",
+        "_finalizer",
+        "__weakref__",
+    )
+
+    header = struct.Struct("<HBBBBB")  # number dealer status bidder bids tricks
+    statuses = [
+        "Bidding in progress",
+        "Bidding all passed",
+        "Bidding complete",
+        "Card play in progress",
+        "Card play complete",
+    ]
+
+    def __init__(self, rules, max_rounds=None, spill_path=None):
+        self.rules = rules
+        self.max_rounds = max_rounds
+        self.spill_path = spill_path
+        self.records = []
+        self.offsets = array("Q")  # start offset of each spilled record
+        self.closed = False
+        self._spill = None
+        self._finalizer = None
+
+    def __getstate__(self):
+        return self.rules, self.max_rounds, [self.record(i) for i in range(len(self))]
+
+    def __setstate__(self, state):
+        rules, max_rounds, records = state
+        self.__init__(rules, max_rounds)
+        self.records = records
+
+    def __len__(self):
+        return len(self.offsets) + len(self.records)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.unpack(self.record(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def spilled(self):
+        return len(self.offsets)
+
+    def append(self, round_):
+        """Packs and stores a completed round."""
+        if self.closed:
+            raise ValueError("append to closed round history")
+        self.records.append(self.pack(round_))
+        if self.max_rounds is not None and len(self.records) > self.max_rounds:
+            self.spill(self.records.pop(0))
+
+    def spill(self, record):
+        """Appends a record to the spill file."""
+        if self._spill is None:
+            temp = self.spill_path is None
+            if temp:
+                fd, self.spill_path = tempfile.mkstemp(suffix=".rounds")
+                os.close(fd)
+            self._spill = open(self.spill_path, "w+b")
+            self._finalizer = weakref.finalize(
+                self, self._close_spill, self._spill, self.spill_path if temp else None
+            )
+        self._spill.seek(0, os.SEEK_END)
+        self.offsets.append(self._spill.tell())
+        self._spill.write(struct.pack("<H", len(record)) + record)
+
+    def close(self):
+        """Closes the spill file, removing it if temporary."""
+        self.closed = True
+        if self._finalizer is not None:
+            self._finalizer()
+            self._spill = None
+
+    @staticmethod
+    def _close_spill(spill, temp_path):
+        spill.close()
+        if temp_path is not None:
+            os.remove(temp_path)
+
+    def record(self, i):
+        """Returns the packed record of round index i."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("round index out of range")
+        if i >= len(self.offsets):
+            return self.records[i - len(self.offsets)]
+        if self.closed:
+            raise ValueError("spilled round of closed round history")
+        self._spill.seek(self.offsets[i])
+        (size,) = struct.unpack("<H", self._spill.read(2))
+        return self._spill.read(size)
+
+    def pack(self, round_):
+        """Packs a Round into a record."""
+        hands = bytes(card.id for hand in round_.starting_hands for card in hand)
+        highest_bidder = 255 if round_.highest_bidder is None else round_.highest_bidder
+        parts = [
+            RoundHistory.header.pack(
+                round_.number,
+                round_.dealer,
+                RoundHistory.statuses.index(round_.status),
+                highest_bidder,
+                len(round_.bids),
+                len(round_.tricks),
+            ),
+            hands,
+            bytes(bid.id for bid in round_.bids),
+        ]
+        for trick in round_.tricks:
+            parts.append(bytes([trick.lead, trick.winner, len(trick.cards)]))
+            parts.append(bytes(card.id for card in trick.cards))
+        parts.append(bytes(round_.tricks_won))
+        parts.append(struct.pack("<%sh" % len(round_.scores), *round_.scores))
+        return b"".join(parts)
+
+    def unpack(self, record):
+        """Materializes a Round from a record."""
+        rules = self.rules
+        number, dealer, status, highest_bidder, num_bids, num_tricks = (
+            RoundHistory.header.unpack_from(record)
+        )
+        pos = RoundHistory.header.size
+        round_ = Round(number, dealer, rules)
+
+        deck_size = len(rules.deck_ids)
+        ids = record[pos : pos + deck_size]
+        pos += deck_size
+        size = rules.hand_size
+        round_.starting_hands = [
+            [Card.cards[i] for i in ids[p * size : (p + 1) * size]]
+            for p in range(rules.players)
+        ] + [[Card.cards[i] for i in ids[rules.players * size :]]]
+
+        # replay the bids to restore passes, highest bid and possible bids
+        round_.turn = (dealer + 1) % rules.players
+        for bid_id in record[pos : pos + num_bids]:
+            round_.make_bid(Bid.ladder[bid_id])
+            round_.update_status()
+        pos += num_bids
+        round_.trump_suit = round_.highest_bid.suit
+        round_.status = RoundHistory.statuses[status]
+
+        misere = highest_bidder if round_.highest_bid.misere is not None else None
+        suits = Card.suits[round_.trump_suit]
+        for trick_num in range(num_tricks):
+            lead, winner, num_cards = record[pos : pos + 3]
+            trick = Trick(lead, trick_num, misere, rules)
+            trick.cards = [Card.cards[i] for i in record[pos + 3 : pos + 3 + num_cards]]
+            trick.lead_suit = suits[trick.cards[0].id]
+            trick.winner = winner
+            round_.tricks.append(trick)
+            round_.turn = winner
+            pos += 3 + num_cards
+
+        teams = rules.teams
+        round_.tricks_won = list(record[pos : pos + teams])
+        round_.scores = list(struct.unpack_from("<%sh" % teams, record, pos + teams))
+        return round_
 
 
 class Game(object):
     """Represents a game.
 
     Attributes:
-        rounds (list): list of Round objects in game
+        rounds (RoundHistory): completed Round objects in game
         round (Round): current Round object
         round_number (int): current round number
         dealer (int): player index of current dealer
@@ -485,67 +978,96 @@ class Game(object):
         status (str): current status of the game {'In progress', 'Complete'}
         players (list): list of players (Hand objects) in the game
         kitty (Hand): the kitty container
+        events (EventBus): bus the game narration is emitted on
+        policy (Policy): AI policy making the computer players' decisions
+        rules (Rules): rule set of the game
+        max_rounds (int): completed rounds kept in memory, older rounds are
+            spilled to disk, all kept if NoneType
+        ponderer (Ponderer): thinks ahead for the computer players while a
+            human decides, no pondering if NoneType
     """
 
-    def __init__(self):
-        self.rounds = []
+    __slots__ = (
+        "rounds",
+        "round",
+        "round_number",
+        "dealer",
+        "scores",
+        "status",
+        "players",
+        "kitty",
+        "events",
+        "policy",
+        "rules",
+        "ponderer",
+    )
+
+    def __init__(self, events=None, policy=None, rules=None, max_rounds=None, ponderer=None):
+        self.rules = rules if rules is not None else RULES["standard"]
+        self.rounds = RoundHistory(self.rules, max_rounds)
         self.round = None
         self.round_number = 0
         self.dealer = -1
-        self.scores = [0, 0]
+        self.scores = [0] * self.rules.teams
         self.status = "In progress"
 
         # initialise players
-        self.players = [Hand("P1"), Hand("P2"), Hand("P3"), Hand("P4")]
+        self.players = [Hand("P%s" % (i + 1)) for i in range(self.rules.players)]
         self.kitty = Hand()
+        self.events = events if events is not None else EventBus()
+        self.policy = policy if policy is not None else Policy()
+        self.ponderer = ponderer
 
     def deal(self):
         """Deal the cards."""
         # initialise new deck
-        deck = Deck()
+        deck = Deck(self.rules)
         deck.shuffle()
 
         # deal to players
         for player in self.players:
             player.cards = []
-            deck.deal_cards(player, 10)
+            deck.deal_cards(player, self.rules.hand_size)
             player.sort()
 
         # deal to kitty
         self.kitty.cards = []
         self.kitty.label = "Kitty"
-        deck.deal_cards(self.kitty, 3)
+        deck.deal_cards(self.kitty, len(deck.cards))
 
     def start_round(self):
         """Starts a new round."""
         self.round_number += 1
-        self.dealer = (self.dealer + 1) % 4
-        self.round = Round(self.round_number, self.dealer)
+        self.dealer = (self.dealer + 1) % self.rules.players
+        self.round = Round(self.round_number, self.dealer, self.rules)
         trump_suit = None
         self.deal()
         self.round.starting_hands = [player.cards[:] for player in self.players] + [
             self.kitty.cards[:]
         ]
 
-        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-        print("Round %s" % (self.round_number))
-        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        self.events.emit(RoundStarted, self.round_number, self.dealer)
+        self.events.emit(
+            Deal, self.round_number, self.round.starting_hands[:-1], self.round.starting_hands[-1]
+        )
 
-    def bid_round(self, policy):
-        """Starts a round of bidding."""
+    def bid_round(self, policy, discard_policy=None):
+        """Starts a round of bidding.
+
+        Args:
+            policy (?): AI policy for bidding strategy
+            discard_policy (?): AI policy for the discard that follows,
+                exhaustive discards are pondered while a human bids
+        """
         # setup
         br = self.round
-        br.turn = (self.dealer + 1) % 4
-
-        print("\n========================================")
-        print("Begin bidding")
-        print("========================================")
+        self.start_bidding()
 
         # bidding in progress
         while br.status == "Bidding in progress":
             # passed players cannot make any more bids in round
             if br.passes[br.turn]:
-                br.make_bid(Bid(None))
+                self.make_bid(Bid(None))
                 continue
 
             if br.turn == HUMAN_PLAYER or policy == "human":
@@ -561,34 +1083,63 @@ class Game(object):
                     )
                 )
                 print("Possible -", " ".join(br.possible_bids))
+                if (
+                    self.ponderer is not None
+                    and policy != "human"
+                    and discard_policy == "exhaustive"
+                ):
+                    self.ponderer.start(self.ponder_discards, policy)
                 bid_text = input("Bid (blank for pass):")
+                if self.ponderer is not None:
+                    self.ponderer.stop()
             else:
-                pol = Policy()
                 try:
-                    bid_text = pol.bid(
+                    bid_text = self.policy.bid(
                         (self.players[br.turn], br.bids, br.possible_bids, Bid), policy
                     )
                 except IndexError:
                     bid_text = ""
-            br.make_bid(Bid(bid_text))
-            br.update_status()
+            self.make_bid(Bid(bid_text))
 
         # bidding finished
+        self.end_bidding()
+
+    def start_bidding(self):
+        """Sets up a round of bidding, see bid_round."""
+        self.round.turn = (self.dealer + 1) % self.rules.players
+        self.events.emit(PhaseStarted, "bidding")
+
+    def make_bid(self, bid):
+        """Makes a bid for the player to bid and emits it.
+
+        Args:
+            bid (Bid): Bid object
+
+        Returns:
+            whether the bid was made
+        """
+        br = self.round
+        turn = br.turn
+        br.make_bid(bid)
+        if br.turn == turn:
+            return False
+        self.events.emit(BidMade, turn, br.bids[-1])
+        br.update_status()
+        return True
+
+    def end_bidding(self):
+        """Finishes a round of bidding, the highest bidder takes the kitty."""
+        br = self.round
         if br.status == "Bidding complete":
-            print("\n--------------------------")
-            print("Bidding complete")
-            print(self.players[br.highest_bidder].label, "-", br.highest_bid)
-            print("|".join([str(bid) for bid in br.bids]))
-            print("--------------------------")
+            self.events.emit(BiddingComplete, br.highest_bidder, br.highest_bid, br.bids)
             br.trump_suit = br.highest_bid.suit
+            self.events.emit(KittyTaken, br.highest_bidder, self.kitty.cards[:])
             self.kitty.deal_cards(
                 self.players[br.highest_bidder], 3
             )  # winning bidder gets kitty
 
         elif br.status == "Bidding all passed":
-            print("\n--------------------------")
-            print("Bidding complete - all passed")
-            print("--------------------------")
+            self.events.emit(BiddingComplete, None, None, br.bids)
 
     def discard_round(self, policy):
         """Discards extra 3 cards from hand back to kitty.
@@ -606,32 +1157,40 @@ class Game(object):
             )
             cards = [player.cards[int(x)] for x in discard_text.split(",")]
         elif policy is not None:
-            pol = Policy()
-            cards = pol.discard((player.cards, dr.highest_bid), policy)
+            cards = None
+            if self.ponderer is not None and policy == "exhaustive":
+                cards = self.ponderer.pop(
+                    ("discard", dr.number, dr.highest_bidder, dr.highest_bid.id)
+                )
+            if cards is None:
+                cards = self.policy.discard((player.cards, dr.highest_bid), policy)
         else:
             raise ValueError
 
         # make discard
-        player.move_cards(self.kitty, cards)
+        self.make_discard(cards)
+
+    def make_discard(self, cards):
+        """Moves the discards of the highest bidder to the kitty and emits
+        them.
+
+        Args:
+            cards (list): list of Card objects to discard
+        """
+        dr = self.round
+        self.players[dr.highest_bidder].move_cards(self.kitty, cards)
         self.kitty.label = "Discard"
+        self.events.emit(Discard, dr.highest_bidder, cards)
 
     def card_round(self, policy):
         """Starts a round of card playing."""
         # setup
         cr = self.round
-        cr.status = "Card play in progress"
-        misere = None
-        if cr.highest_bid.misere is not None:
-            misere = cr.highest_bidder
-        cr.turn = cr.highest_bidder
-
-        print("\n========================================")
-        print("Begin card play")
-        print("========================================")
+        misere = self.start_card_play()
 
         # card play in progress
-        for trick_num in range(10):
-            trick = Trick(cr.turn, trick_num, misere)
+        for trick_num in range(self.rules.tricks):
+            trick = Trick(cr.turn, trick_num, misere, self.rules)
 
             while not trick.is_complete():
                 self.players[cr.turn].set_possible(trick)
@@ -653,58 +1212,218 @@ class Game(object):
                     input_text = "Card index ({0}):".format(
                         " ".join([str(_) for _ in self.players[cr.turn].possible_index])
                     )
+                    if self.ponderer is not None and policy != "human":
+                        self.ponderer.start(self.ponder_cards, trick, policy)
                     hand_index = input(input_text)
+                    if self.ponderer is not None:
+                        self.ponderer.stop()
                     if hand_index:
                         hand_index = int(hand_index)
                 elif policy is not None:
-                    pol = Policy()
-                    hand_index = pol.card(
-                        (self.players[cr.turn], trick, cr.tricks), policy
-                    )
+                    hand_index = None
+                    env = (self.players[cr.turn], trick, cr.tricks, cr.knowledge[cr.turn])
+                    if self.ponderer is not None:
+                        state = random.getstate()
+                        hand_index = self.ponderer.pop(
+                            self.card_key(cr.turn, trick, self.players[cr.turn], cr.tricks)
+                        )
+                        if hand_index is not None and self.ponderer.check:
+                            random.setstate(state)
+                            fresh = self.policy.card(env, policy)
+                            if fresh != hand_index:
+                                raise RuntimeError(
+                                    "Pondered card {0} differs from fresh card {1}".format(
+                                        hand_index, fresh
+                                    )
+                                )
+                    if hand_index is None:
+                        hand_index = self.policy.card(env, policy)
                 else:
                     raise ValueError
 
-                cr.play_card(self.players[cr.turn], hand_index, trick)
-
-            trick.set_winner()
-            cr.turn = trick.winner
-            cr.tricks_won[trick.winner % 2] += 1
-            cr.tricks.append(trick)
+                self.play_card(hand_index, trick)
 
-            print("\n--------------------------")
-            print("Trick         :", trick_num + 1)
-            print("Cards Played  :", trick)
-            print("Lead          :", self.players[trick.lead].label)
-            print("Winner        :", self.players[trick.winner].label)
-            print("Trick Count   :", cr.tricks_won)
-            print("--------------------------")
+            self.end_trick(trick)
 
         # card play complete
+        self.end_card_play()
+
+    def start_card_play(self):
+        """Sets up a round of card playing, see card_round.
+
+        Returns:
+            seat of the misere player, NoneType if not misere
+        """
+        cr = self.round
+        cr.status = "Card play in progress"
+        misere = None
+        if cr.highest_bid.misere is not None:
+            misere = cr.highest_bidder
+        cr.turn = cr.highest_bidder
+        cr.start_knowledge(self.players, self.kitty.cards)
+        self.events.emit(PhaseStarted, "card play")
+        return misere
+
+    def play_card(self, hand_index, trick):
+        """Plays a card of the player to play and emits it.
+
+        Args:
+            hand_index (int): index of the card in the player's hand
+            trick (Trick): current trick
+
+        Returns:
+            whether the card was played
+        """
+        cr = self.round
+        turn = cr.turn
+        lead_suit = trick.lead_suit
+        cr.play_card(self.players[turn], hand_index, trick)
+        if cr.turn == turn:
+            return False
+        for knowledge in cr.knowledge:
+            knowledge.play(turn, trick.cards[-1], lead_suit)
+        self.events.emit(CardPlayed, trick.number, turn, trick.cards[-1])
+        return True
+
+    def end_trick(self, trick):
+        """Scores a complete trick, the winner leads the next trick."""
+        cr = self.round
+        trick.set_winner()
+        cr.turn = trick.winner
+        cr.tricks_won[self.rules.team(trick.winner)] += 1
+        cr.tricks.append(trick)
+        self.events.emit(TrickWon, trick, cr.tricks_won[:])
+
+    def end_card_play(self):
+        """Finishes a round of card playing and scores the round."""
+        cr = self.round
         cr.status = "Card play complete"
         cr.set_scores()
 
+    def card_key(self, seat, trick, player, tricks):
+        """Returns the ponder key of a card decision.
+
+        Notes:
+            Includes the cards played so far in the round, decisions also
+            depend on what was played before the current trick.
+        """
+        return (
+            "card",
+            self.round.number,
+            seat,
+            tuple(card.id for t in tricks for card in t.cards),
+            tuple(card.id for card in trick.cards),
+            tuple(card.id for card in player.cards),
+        )
+
+    def ponder_discards(self, policy):
+        """Yields the exhaustive discards of computer players that may win
+        the bidding, see Ponderer.
+
+        Notes:
+            Candidates are the current highest bid and the bid each other
+            computer player would make now.
+
+        Args:
+            policy (?): AI policy for bidding strategy
+        """
+        br = self.round
+        candidates = []
+        if br.highest_bidder is not None and br.highest_bidder != HUMAN_PLAYER:
+            candidates.append((br.highest_bidder, br.highest_bid))
+        for seat, player in enumerate(self.players):
+            if seat == HUMAN_PLAYER or br.passes[seat]:
+                continue
+            try:
+                bid_text = self.policy.bid((player, br.bids, br.possible_bids, Bid), policy)
+            except IndexError:
+                bid_text = ""
+            if bid_text:
+                candidates.append((seat, Bid(bid_text)))
+
+        for seat, bid in candidates:
+            # the kitty is dealt from the end, see Deck.deal_cards
+            cards = self.players[seat].cards + self.kitty.cards[::-1]
+            discard = self.policy.exhaustive_discard(cards, bid, self.ponderer.budget)
+            yield ("discard", br.number, seat, bid.id), discard
+
+    def ponder_cards(self, trick, policy):
+        """Yields the card decisions of computer players up to the human's
+        next turn, for each card the human may play, see Ponderer.
+
+        Notes:
+            Plays on copies of the hands, trick and knowledge, the game
+            state is only read. Each card of the human is tried from the
+            random state pondering started from, see Ponderer.
+
+        Args:
+            trick (Trick): current trick, the human is to play
+            policy (?): AI policy for card strategy
+        """
+        cr = self.round
+        human = cr.turn
+        for card in list(self.players[human].possible):
+            self.ponderer.rewind()
+
+            # copy the state
+            r = Round(cr.number, cr.dealer, self.rules)
+            r.status = cr.status
+            r.highest_bid = cr.highest_bid
+            r.highest_bidder = cr.highest_bidder
+            r.turn = human
+            r.tricks = cr.tricks[:]
+            players = []
+            for player in self.players:
+                copy = Hand(player.label)
+                copy.cards = player.cards[:]
+                players.append(copy)
+            knowledge = [k.copy() for k in cr.knowledge]
+            t = Trick(trick.lead, trick.number, trick.misere, self.rules)
+            t.cards = trick.cards[:]
+            t.lead_suit = trick.lead_suit
+
+            hand_index = players[human].cards.index(card)
+            while True:
+                players[r.turn].set_possible(t)
+                if hand_index is None:
+                    if r.turn == human:
+                        break
+                    hand_index = self.policy.card(
+                        (players[r.turn], t, r.tricks, knowledge[r.turn]), policy
+                    )
+                    yield self.card_key(r.turn, t, players[r.turn], r.tricks), hand_index
+
+                turn = r.turn
+                lead_suit = t.lead_suit
+                r.play_card(players[turn], hand_index, t)
+                hand_index = None
+                for k in knowledge:
+                    k.play(turn, t.cards[-1], lead_suit)
+
+                if t.is_complete():
+                    t.set_winner()
+                    r.turn = t.winner
+                    r.tricks.append(t)
+                    if len(r.tricks) == self.rules.tricks:
+                        break
+                    t = Trick(r.turn, len(r.tricks), t.misere, self.rules)
+
     def end_round(self):
         """Ends a round."""
         self.rounds.append(self.round)
         self.scores = [a + b for a, b in zip(self.scores, self.round.scores)]
-        if max(abs(i) for i in self.scores) >= 500:
+        if max(abs(i) for i in self.scores) >= self.rules.finish:
             self.status = "Complete"
 
-        print("\n--------------------------")
-        print("Round {0} complete".format(self.round_number))
-        print("Round Score: ", self.round.scores)
-        print("Game Scores: ", self.scores)
-        print("Game Status: ", self.status)
-        print("--------------------------")
+        self.events.emit(
+            RoundScored, self.round_number, self.round.scores, self.scores, self.status
+        )
 
     def print_hands(self):
-        """Sorts and prints hands including kitty."""
+        """Sorts hands and emits them for display including kitty."""
         for player in self.players:
             player.sort()
-            if HUMAN_PLAYER == self.players.index(player) or HUMAN_PLAYER is None:
-                print(player.label, player)
-        if HUMAN_PLAYER is None:
-            print(self.kitty.label, self.kitty)
+        self.events.emit(HandsShown, self.players, self.kitty)
 
 
 if __name__ == "__main__":
@@ -713,10 +1432,17 @@ if __name__ == "__main__":
     parser.add_argument(
         "--play",
         type=int,
-        choices=range(1, 5),
+        choices=range(1, 7),
         default=None,
         help="Human player",
     )
+    parser.add_argument(
+        "--rules",
+        type=str,
+        choices=sorted(RULES),
+        default="standard",
+        help="Rule variant",
+    )
     parser.add_argument(
         "--bidai",
         type=str,
@@ -724,10 +1450,17 @@ if __name__ == "__main__":
             "human",
             "random",
             "score",
+            "cfr",
         ],
         default="score",
         help="Bid Round AI",
     )
+    parser.add_argument(
+        "--bidstrategy",
+        type=str,
+        default="bidding.cfr",
+        help="Checkpoint of the cfr bidding strategy, see cfr.py",
+    )
     parser.add_argument(
         "--discardai",
         type=str,
@@ -735,10 +1468,23 @@ if __name__ == "__main__":
             "human",
             "random",
             "lowest",
+            "exhaustive",
         ],
         default="lowest",
         help="Discard Round AI",
     )
+    parser.add_argument(
+        "--discardbudget",
+        type=float,
+        default=Policy.discard_budget,
+        help="Seconds per exhaustive discard decision",
+    )
+    parser.add_argument(
+        "--discardworkers",
+        type=int,
+        default=Policy.discard_workers,
+        help="Worker processes for exhaustive discard",
+    )
     parser.add_argument(
         "--cardai",
         type=str,
@@ -747,10 +1493,39 @@ if __name__ == "__main__":
             "random",
             "highest",
             "basic",
+            "counting",
+            "endgame",
         ],
         default="basic",
         help="Card Round AI",
     )
+    parser.add_argument(
+        "--tablebase",
+        type=str,
+        default="endgame.tb",
+        help="Endgame tablebase of the endgame card AI, see endgame.py",
+    )
+    parser.add_argument(
+        "--noponder",
+        action="store_true",
+        help="Computer players do not think ahead while the human decides",
+    )
+    parser.add_argument(
+        "--pondercheck",
+        action="store_true",
+        help="Check pondered card decisions against fresh ones",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not print game narration",
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        help="File to write game events to as JSON lines",
+        default=None,
+    )
     parser.add_argument(
         "--savedir",
         type=str,
@@ -763,6 +1538,16 @@ if __name__ == "__main__":
     BID_POLICY = args.bidai
     DISCARD_POLICY = args.discardai
     CARD_POLICY = args.cardai
+    Policy.discard_budget = args.discardbudget
+    Policy.discard_workers = args.discardworkers
+    if BID_POLICY == "cfr":
+        from cfr import BidStrategy
+
+        Policy.bid_strategy = BidStrategy.load(args.bidstrategy, args.rules)
+    if CARD_POLICY == "endgame":
+        from endgame import Tablebase
+
+        Policy.tablebase = Tablebase(args.tablebase)
 
     if args.play:
         HUMAN_PLAYER = args.play - 1
@@ -771,7 +1556,15 @@ if __name__ == "__main__":
 
     # setup game
     trump_suit = None
-    game = Game()
+    ponderer = None
+    if HUMAN_PLAYER is not None and not args.noponder:
+        ponderer = Ponderer(check=args.pondercheck)
+    game = Game(rules=RULES[args.rules], ponderer=ponderer)
+    if not args.quiet:
+        game.events.subscribe(ConsoleRenderer(game, HUMAN_PLAYER))
+    if args.log:
+        log_file = open(args.log, "w")
+        game.events.subscribe(JsonLogWriter(log_file))
 
     # main game loop
     while game.status == "In progress":
@@ -780,7 +1573,7 @@ if __name__ == "__main__":
         game.print_hands()
 
         # bidding
-        game.bid_round(policy=BID_POLICY)
+        game.bid_round(policy=BID_POLICY, discard_policy=DISCARD_POLICY)
         if game.round.status == "Bidding complete":
             trump_suit = game.round.trump_suit
 
@@ -794,6 +1587,9 @@ if __name__ == "__main__":
         # end round
         game.end_round()
 
+    if args.log:
+        log_file.close()
+
     if args.savedir:
         import pickle
         import time
@@ -0,0 +1,633 @@
+# -*- coding: utf-8 -*-
+"""Core kernels over integer card arrays.
+
+Cards are card ids (see Card.id), hands are rows of card ids with a count
+per row. Suits, lead suits and misere seats use -1 for NoneType, trumps
+are indexed 0-3 for suits and 4 for no trumps.
+
+The kernels are compiled with numba when it is installed, otherwise the
+same functions run as plain Python over lists. Random playouts draw from
+a xorshift generator seeded from the random module, so seeded games play
+the same with and without numba. check_parity compares the kernels with
+the reference engine (Trick, Hand, Round and ai.score_hand). The
+"endgame" card policy scores its sampled deals with random_playouts until
+the hands are within the endgame tablebase, see Policy.endgame_card.
+
+    python fivehundred/kernels.py --parity 2000 --bench 2000
+"""
+import argparse
+import random
+import time
+
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
+import ai
+import game
+from game import RULES, Bid, Card, Deck, Hand, Round, Trick
+
+HAVE_NUMBA = numba is not None
+NO_TRUMPS = 4
+
+if HAVE_NUMBA:
+    jit = numba.njit(cache=True)
+else:
+
+    def jit(fn):
+        return fn
+
+
+def trump_index(trump):
+    """Returns the table index of a trump suit."""
+    return NO_TRUMPS if trump is None else trump
+
+
+def to_array(rows):
+    """Returns an int array (nested for rows) for the kernels."""
+    if HAVE_NUMBA:
+        return np.array(rows, np.int64)
+    if rows and isinstance(rows[0], list):
+        return [list(row) for row in rows]
+    return list(rows)
+
+
+def build_tables():
+    """Returns the card tables (values, suits, strengths, natural, ranks).
+
+    values and suits are indexed by trump index then card id, strengths,
+    natural suits and bid ranks by card id.
+    """
+    ids = range(len(Card.cards))
+    none = lambda value: -1 if value is None else value
+    values = [[Card.values[t][i] for i in ids] for t in Card.trumps]
+    suits = [[none(Card.suits[t][i]) for i in ids] for t in Card.trumps]
+    strengths = [none(s) for s in Card.strengths]
+    natural = [-1 if card.joker else card.suit for card in Card.cards]
+    ranks = [
+        -1 if card.joker else card.rank if card.rank < 13 else 8 for card in Card.cards
+    ]
+    return tuple(
+        to_array(table) for table in (values, suits, strengths, natural, ranks)
+    )
+
+
+VALUES, SUITS, STRENGTHS, NATURAL, RANKS = build_tables()
+
+
+@jit
+def trick_winner(
+    cards,
+    n,
+    lead,
+    lead_suit,
+    misere,
+    partner,
+    players,
+    trump,
+    values,
+    strengths,
+    natural,
+):
+    """Returns the winning seat of a trick, see Trick.get_winner.
+
+    Args:
+        cards: card ids played
+        n (int): number of cards played
+        lead (int): seat of lead player
+        lead_suit (int): suit led
+        misere (int): seat of misere player
+        partner (int): seat offset of partner, 0 for no partners
+        players (int): number of players
+        trump (int): trump index
+    """
+    best = -1
+    winner = -1
+    seat = lead
+    for i in range(n):
+        if misere >= 0 and partner > 0 and (misere + partner) % players == seat:
+            seat = (seat + 1) % players
+        card = cards[i]
+        value = values[trump][card]
+        if (
+            natural[card] >= 0
+            and natural[card] == lead_suit
+            and strengths[card] + 1 > value
+        ):
+            value = strengths[card] + 1
+        if value > best:
+            best = value
+            winner = seat
+        seat = (seat + 1) % players
+    return winner
+
+
+@jit
+def legal_mask(hand, n, lead_suit, trump, suits, mask):
+    """Sets mask[i] to 1 for legal cards of hand, see Hand.set_possible.
+
+    Returns:
+        number of legal cards
+    """
+    count = 0
+    if lead_suit >= 0:
+        for i in range(n):
+            if suits[trump][hand[i]] == lead_suit:
+                mask[i] = 1
+                count += 1
+            else:
+                mask[i] = 0
+    if count == 0:
+        for i in range(n):
+            mask[i] = 1
+        count = n
+    return count
+
+
+@jit
+def score_hand(hand, n, natural, ranks, scores):
+    """Bid scoring, see ai.score_hand.
+
+    Sets scores[0:5] to the maximum tricks for each suit and no trumps.
+
+    Returns:
+        misere danger count
+    """
+    for s in range(5):
+        scores[s] = 0
+    misere = 0
+    for i in range(n):
+        card = hand[i]
+        if natural[card] < 0:
+            for s in range(5):
+                scores[s] += 15
+            misere += 2
+        else:
+            rank = ranks[card]
+            suit = natural[card]
+            if rank > 7:
+                misere += 1
+            scores[suit] += rank
+            if rank > 10:
+                scores[4] += rank
+            if rank == 9:
+                scores[suit] += 5
+                scores[(suit + 2) % 4] += 4
+    for s in range(5):
+        scores[s] = scores[s] // 15 + 5
+    return misere
+
+
+@jit
+def next_random(state):
+    """Advances the xorshift generator in state[0], returns the next value.
+
+    The state is a non-zero 32-bit int, kept below 2**32 so that the
+    shifts do not overflow int64 under numba.
+    """
+    x = state[0]
+    x ^= (x << 13) & 0xFFFFFFFF
+    x ^= x >> 17
+    x ^= (x << 5) & 0xFFFFFFFF
+    state[0] = x
+    return x
+
+
+@jit
+def playout(
+    hands,
+    counts,
+    leader,
+    trump,
+    misere,
+    partner,
+    players,
+    tricks,
+    first,
+    state,
+    played,
+    n_played,
+    won,
+    trick,
+    mask,
+    values,
+    suits,
+    strengths,
+    natural,
+):
+    """Plays out the remaining tricks of a round.
+
+    Cards are chosen at random from the legal cards, or the first legal
+    card if first is set. hands and counts are consumed.
+
+    Args:
+        hands: per seat rows of card ids
+        counts: number of cards in each row
+        leader (int): seat leading the first trick
+        tricks (int): number of tricks to play
+        first (bool): play the first legal card
+        state: xorshift state, see next_random
+        played: card ids already played to the first trick
+        n_played (int): number of cards already played to the first trick
+        won: set to the tricks won by each seat
+        trick, mask: scratch rows of at least players and hand size
+    """
+    for seat in range(players):
+        won[seat] = 0
+    size = players
+    if misere >= 0 and partner > 0:
+        size -= 1
+
+    for t in range(tricks):
+        seat = leader
+        lead_suit = -1
+        start = 0
+        if t == 0 and n_played > 0:
+            lead_suit = suits[trump][played[0]]
+            for n in range(n_played):
+                if misere >= 0 and partner > 0 and (misere + partner) % players == seat:
+                    seat = (seat + 1) % players
+                trick[n] = played[n]
+                seat = (seat + 1) % players
+            start = n_played
+        for n in range(start, size):
+            if misere >= 0 and partner > 0 and (misere + partner) % players == seat:
+                seat = (seat + 1) % players
+            hand = hands[seat]
+            count = legal_mask(hand, counts[seat], lead_suit, trump, suits, mask)
+            k = 0 if first else next_random(state) % count
+            pick = 0
+            while mask[pick] == 0 or k > 0:
+                if mask[pick] == 1:
+                    k -= 1
+                pick += 1
+            card = hand[pick]
+            if n == 0:
+                lead_suit = suits[trump][card]
+            trick[n] = card
+
+            # remove the card keeping the hand order
+            for j in range(pick, counts[seat] - 1):
+                hand[j] = hand[j + 1]
+            counts[seat] -= 1
+            seat = (seat + 1) % players
+
+        leader = trick_winner(
+            trick,
+            size,
+            leader,
+            lead_suit,
+            misere,
+            partner,
+            players,
+            trump,
+            values,
+            strengths,
+            natural,
+        )
+        won[leader] += 1
+
+
+@jit
+def playouts(
+    source,
+    source_counts,
+    reps,
+    leader,
+    trump,
+    misere,
+    partner,
+    players,
+    tricks,
+    state,
+    played,
+    n_played,
+    hands,
+    counts,
+    won,
+    totals,
+    trick,
+    mask,
+    values,
+    suits,
+    strengths,
+    natural,
+):
+    """Runs reps random playouts from the same hands, summing tricks won."""
+    for seat in range(players):
+        totals[seat] = 0
+    for _ in range(reps):
+        for seat in range(players):
+            counts[seat] = source_counts[seat]
+            for j in range(source_counts[seat]):
+                hands[seat][j] = source[seat][j]
+        playout(
+            hands,
+            counts,
+            leader,
+            trump,
+            misere,
+            partner,
+            players,
+            tricks,
+            False,
+            state,
+            played,
+            n_played,
+            won,
+            trick,
+            mask,
+            values,
+            suits,
+            strengths,
+            natural,
+        )
+        for seat in range(players):
+            totals[seat] += won[seat]
+
+
+def _hands_arrays(hands, rules):
+    width = max(len(hand) for hand in hands) or 1
+    rows = [[card.id for card in hand] + [0] * (width - len(hand)) for hand in hands]
+    return to_array(rows), to_array([len(hand) for hand in hands]), width
+
+
+def random_seed():
+    """Returns a xorshift seed drawn from the random module."""
+    return random.randrange(1, 1 << 32)
+
+
+def random_playouts(
+    hands,
+    leader,
+    trump,
+    misere=None,
+    rules=None,
+    reps=1,
+    first=False,
+    cards=(),
+    seed=None,
+):
+    """Plays out hands, returns the total tricks won by each seat.
+
+    Args:
+        hands (list): list of lists of Card objects for each seat
+        leader (int): seat leading the first trick
+        trump (int): trump suit, NoneType for no trumps
+        misere (int): seat of misere player, NoneType if not misere
+        rules (Rules): rule set, standard 4-player rules if NoneType
+        reps (int): number of playouts
+        first (bool): play the first legal card instead of a random one
+        cards (list): Card objects already played to the first trick
+        seed (int): seed of the random playouts, see next_random, drawn
+            from the random module if NoneType
+    """
+    rules = rules if rules is not None else RULES["standard"]
+    if seed is None and not first:
+        seed = random_seed()
+    state = to_array([seed or 1])
+    source, source_counts, width = _hands_arrays(hands, rules)
+    tricks = max(len(hand) for hand in hands)
+    args = (
+        trump_index(trump),
+        -1 if misere is None else misere,
+        rules.partner or 0,
+        rules.players,
+        tricks,
+    )
+    played = to_array([card.id for card in cards] + [0] * (rules.players - len(cards)))
+    scratch = to_array([[0] * width for _ in hands])
+    counts = to_array([0] * rules.players)
+    won = to_array([0] * rules.players)
+    trick = to_array([0] * rules.players)
+    mask = to_array([0] * width)
+    tables = (VALUES, SUITS, STRENGTHS, NATURAL)
+
+    if first:
+        totals = [0] * rules.players
+        for _ in range(reps):
+            for seat in range(rules.players):
+                counts[seat] = source_counts[seat]
+                for j in range(source_counts[seat]):
+                    scratch[seat][j] = source[seat][j]
+            playout(
+                scratch,
+                counts,
+                leader,
+                *args,
+                True,
+                state,
+                played,
+                len(cards),
+                won,
+                trick,
+                mask,
+                *tables,
+            )
+            totals = [a + b for a, b in zip(totals, won)]
+        return [int(total) for total in totals]
+
+    totals = to_array([0] * rules.players)
+    playouts(
+        source,
+        source_counts,
+        reps,
+        leader,
+        *args,
+        state,
+        played,
+        len(cards),
+        scratch,
+        counts,
+        won,
+        totals,
+        trick,
+        mask,
+        *tables,
+    )
+    return [int(total) for total in totals]
+
+
+def reference_playout(hands, leader, trump, misere=None, rules=None, seed=None):
+    """Playout with the engine objects, for parity.
+
+    Args:
+        seed (int): seed of the random playout, see random_playouts, the
+            first legal card is played if NoneType
+    """
+    rules = rules if rules is not None else RULES["standard"]
+    state = to_array([seed or 1])
+    game.trump_suit = trump
+    players = []
+    for cards in hands:
+        player = Hand()
+        player.cards = list(cards)
+        players.append(player)
+
+    round_ = Round(0, 0, rules)
+    round_.status = "Card play in progress"
+    round_.highest_bid = Bid("CM") if misere is not None else Bid("6S")
+    round_.highest_bidder = leader
+    round_.turn = leader
+    won = [0] * rules.players
+    for trick_num in range(max(len(cards) for cards in hands)):
+        trick = Trick(round_.turn, trick_num, misere, rules)
+        while not trick.is_complete():
+            player = players[round_.turn]
+            player.set_possible(trick)
+            k = 0 if seed is None else next_random(state) % len(player.possible_index)
+            round_.play_card(player, player.possible_index[k], trick)
+        trick.set_winner()
+        round_.turn = trick.winner
+        won[trick.winner] += 1
+    game.trump_suit = None
+    return won
+
+
+def check_parity(n=1000, seed=0):
+    """Compares the kernels with the reference engine on random deals.
+
+    Raises:
+        AssertionError: on the first mismatch
+    """
+    rng = random.Random(seed)
+    mask = to_array([0] * 13)
+    scores = to_array([0] * 5)
+    for name, rules in sorted(RULES.items()):
+        partner = rules.partner or 0
+        for _ in range(n):
+            trump = rng.choice(Card.trumps)
+            t = trump_index(trump)
+            game.trump_suit = trump
+            deck = Deck(rules).cards
+            rng.shuffle(deck)
+
+            # trick resolution
+            misere = rng.choice([None, rng.randrange(rules.players)])
+            lead = rng.randrange(rules.players)
+            if (
+                misere is not None
+                and partner
+                and (misere + partner) % rules.players == lead
+            ):
+                lead = misere
+            sitting_out = misere is not None and partner > 0
+            num = rng.randrange(1, rules.players + 1 - sitting_out)
+            trick = Trick(lead, 0, misere, rules)
+            trick.cards = deck[:num]
+            trick.lead_suit = trick.cards[0].effective_suit()
+            winner = trick_winner(
+                to_array([card.id for card in trick.cards]),
+                num,
+                lead,
+                -1 if trick.lead_suit is None else trick.lead_suit,
+                -1 if misere is None else misere,
+                partner,
+                rules.players,
+                t,
+                VALUES,
+                STRENGTHS,
+                NATURAL,
+            )
+            assert winner == trick.get_winner(), (name, trump, trick.cards)
+
+            # legal moves
+            hand = Hand()
+            hand.cards = deck[num : num + rng.randrange(1, 14)]
+            hand.set_possible(trick)
+            ids = to_array([card.id for card in hand.cards])
+            lead_suit = -1 if trick.lead_suit is None else trick.lead_suit
+            count = legal_mask(ids, len(ids), lead_suit, t, SUITS, mask)
+            legal = [i for i in range(len(ids)) if mask[i]]
+            assert legal == list(hand.possible_index), (name, trump, hand.cards)
+            assert count == len(legal)
+
+            # hand scoring
+            misere_count = score_hand(ids, len(ids), NATURAL, RANKS, scores)
+            assert ([int(s) for s in scores], misere_count) == ai.score_hand(hand.cards)
+
+        # full playouts
+        for _ in range(max(n // 20, 1)):
+            trump = rng.choice(Card.trumps)
+            deck = Deck(rules).cards
+            rng.shuffle(deck)
+            size = rules.hand_size
+            hands = [deck[p * size : (p + 1) * size] for p in range(rules.players)]
+            leader = rng.randrange(rules.players)
+            misere = leader if trump is None and rng.random() < 0.3 else None
+            expected = reference_playout(hands, leader, trump, misere, rules)
+            won = random_playouts(hands, leader, trump, misere, rules, first=True)
+            assert won == expected, (name, trump)
+
+            # from the middle of the first trick, the reference plays the
+            # first legal cards too
+            game.trump_suit = trump
+            trick = Trick(leader, 0, misere, rules)
+            out = (
+                (misere + partner) % rules.players
+                if misere is not None and partner
+                else None
+            )
+            seat = leader
+            for _ in range(rng.randrange(1, rules.players - (out is not None))):
+                player = Hand()
+                player.cards = hands[seat]
+                player.set_possible(trick)
+                card = player.cards.pop(player.possible_index[0])
+                if not trick.cards:
+                    trick.lead_suit = card.effective_suit()
+                trick.cards.append(card)
+                seat = (seat + 1) % rules.players
+                if seat == out:
+                    seat = (seat + 1) % rules.players
+            won = random_playouts(
+                hands, leader, trump, misere, rules, first=True, cards=trick.cards
+            )
+            assert won == expected, (name, trump, "mid-trick")
+
+            # random playouts only depend on the seed
+            for p in range(rules.players):
+                hands[p] = deck[p * size : (p + 1) * size]
+            seed = rng.randrange(1, 1 << 32)
+            expected = reference_playout(hands, leader, trump, misere, rules, seed)
+            won = random_playouts(hands, leader, trump, misere, rules, seed=seed)
+            assert won == expected, (name, trump, "random")
+    game.trump_suit = None
+
+
+def bench(reps):
+    """Times random playouts against the reference engine."""
+    deck = Deck().cards
+    random.shuffle(deck)
+    hands = [deck[p * 10 : (p + 1) * 10] for p in range(4)]
+    random_playouts(hands, 0, 0, reps=1)  # compile
+
+    start = time.perf_counter()
+    random_playouts(hands, 0, 0, reps=reps)
+    kernel = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(reps):
+        reference_playout(hands, 0, 0)
+    reference = time.perf_counter() - start
+
+    print("Numba         :", HAVE_NUMBA)
+    print("Kernel (us)   : %.1f per playout" % (1e6 * kernel / reps))
+    print("Engine (us)   : %.1f per playout" % (1e6 * reference / reps))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--parity", type=int, default=1000, help="Random deals per rule set"
+    )
+    parser.add_argument("--bench", type=int, default=0, help="Playouts to time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    check_parity(args.parity)
+    print("Parity        : ok (%.1fs)" % (time.perf_counter() - start))
+    if args.bench:
+        bench(args.bench)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Card counting and void inference for a seat.
+
+Cards are tracked as bitmasks over card ids (see Card.id) so every update
+and query is O(1).
+"""
+import random
+
+from events import CardPlayed, TrickWon
+
+
+class Knowledge(object):
+    """What a seat knows about the cards of a round.
+
+    Args:
+        seat (int): player index of the seat
+        hand (list): list of Card objects held by the seat
+        deck (list): list of Card objects in the deck
+        trump (int): trump suit, NoneType for no trumps and misere
+        seen (list): other Card objects known to the seat, e.g. discards
+        players (int): number of players
+
+    Attributes:
+        seat (int): directly passed from arg
+        trump (int): directly passed from arg
+        unseen (int): bitmask of card ids the seat has not seen
+        unseen_count (int): number of cards the seat has not seen
+        played (int): bitmask of card ids played
+        voids (list): per player bitmask of effective suits shown void
+        trumps_unseen (int): number of trumps the seat has not seen
+        trumps_played (int): number of trumps played
+    """
+
+    __slots__ = (
+        "seat",
+        "trump",
+        "suits",
+        "unseen",
+        "unseen_count",
+        "played",
+        "voids",
+        "trumps_unseen",
+        "trumps_played",
+        "joker_id",
+        "bower_ids",
+        "lead_suit",
+    )
+
+    def __init__(self, seat, hand, deck, trump, seen=(), players=4):
+        self.seat = seat
+        self.trump = trump
+        self.suits = deck[0].suits[trump]
+        self.unseen = 0
+        self.unseen_count = 0
+        self.played = 0
+        self.voids = [0] * players
+        self.trumps_unseen = 0
+        self.trumps_played = 0
+        self.joker_id = None
+        self.bower_ids = [None, None]  # right, left
+        self.lead_suit = -1  # suit led in the current trick of the event stream
+
+        for card in deck:
+            self.unseen |= 1 << card.id
+            self.unseen_count += 1
+            if trump is not None and self.suits[card.id] == trump:
+                self.trumps_unseen += 1
+            if card.joker:
+                self.joker_id = card.id
+            elif card.bowers[trump][card.id] == "Right":
+                self.bower_ids[0] = card.id
+            elif card.bowers[trump][card.id] == "Left":
+                self.bower_ids[1] = card.id
+        self.see(hand)
+        self.see(seen)
+
+    def copy(self):
+        """Returns an independent copy, e.g. to look ahead without changing
+        this one."""
+        other = object.__new__(Knowledge)
+        for name in Knowledge.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.voids = self.voids[:]
+        other.bower_ids = self.bower_ids[:]
+        return other
+
+    def see(self, cards):
+        """Marks cards as seen by the seat, e.g. its hand or the discards."""
+        for card in cards:
+            bit = 1 << card.id
+            if self.unseen & bit:
+                self.unseen ^= bit
+                self.unseen_count -= 1
+                if self.trump is not None and self.suits[card.id] == self.trump:
+                    self.trumps_unseen -= 1
+
+    def play(self, seat, card, lead_suit):
+        """Updates with a card played in a trick.
+
+        Args:
+            seat (int): player index of the player of the card
+            card (Card): card played
+            lead_suit (int): suit led in the trick, NoneType when leading
+        """
+        self.see([card])
+        self.played |= 1 << card.id
+        suit = self.suits[card.id]
+        if self.trump is not None and suit == self.trump:
+            self.trumps_played += 1
+        if lead_suit is not None and suit != lead_suit:
+            self.voids[seat] |= 1 << lead_suit
+
+    def __call__(self, event):
+        """Updates from game events, see EventBus.subscribe."""
+        if type(event) is CardPlayed:
+            if self.lead_suit == -1:
+                self.lead_suit = self.suits[event.card.id]
+                self.play(event.seat, event.card, None)
+            else:
+                self.play(event.seat, event.card, self.lead_suit)
+        elif type(event) is TrickWon:
+            self.lead_suit = -1
+
+    def is_unseen(self, card):
+        """Returns whether the card could be held by another player."""
+        return bool(self.unseen >> card.id & 1)
+
+    def is_played(self, card):
+        """Returns whether the card has been played."""
+        return bool(self.played >> card.id & 1)
+
+    def is_void(self, seat, suit):
+        """Returns whether the player has shown void in an effective suit."""
+        return bool(self.voids[seat] >> suit & 1)
+
+    def can_hold(self, seat, card):
+        """Returns whether another player could hold the card."""
+        if not self.unseen >> card.id & 1:
+            return False
+        suit = self.suits[card.id]
+        return suit is None or not self.voids[seat] >> suit & 1
+
+    def joker_out(self):
+        """Returns whether the joker has been played."""
+        return self.joker_id is not None and self._played(self.joker_id)
+
+    def right_bower_out(self):
+        """Returns whether the right bower has been played."""
+        return self.bower_ids[0] is not None and self._played(self.bower_ids[0])
+
+    def left_bower_out(self):
+        """Returns whether the left bower has been played."""
+        return self.bower_ids[1] is not None and self._played(self.bower_ids[1])
+
+    def _played(self, card_id):
+        return bool(self.played >> card_id & 1)
+
+    def unseen_ids(self):
+        """Returns the list of card ids the seat has not seen."""
+        mask = self.unseen
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(low.bit_length() - 1)
+            mask ^= low
+        return ids
+
+    def sample_hands(self, deck, sizes, rng=random):
+        """Samples hidden hands consistent with what the seat knows.
+
+        Notes:
+            Cards are dealt most constrained first, a player shown void in
+            a suit is never dealt a card of that suit. Any unseen cards left
+            over are the kitty.
+
+        Args:
+            deck (list): list of Card objects in the deck
+            sizes (dict): number of hidden cards held by each other player
+            rng (Random): random number generator
+
+        Returns:
+            dict of lists of Card objects by player index
+        """
+        by_id = {card.id: card for card in deck}
+        cards = [by_id[i] for i in self.unseen_ids()]
+        rng.shuffle(cards)
+        cards.sort(key=lambda c: sum(self.can_hold(seat, c) for seat in sizes))
+
+        hands = {seat: [] for seat in sizes}
+        for card in cards:
+            seats = [
+                seat
+                for seat in sizes
+                if len(hands[seat]) < sizes[seat] and self.can_hold(seat, card)
+            ]
+            if seats:
+                hands[rng.choice(seats)].append(card)
+        return hands
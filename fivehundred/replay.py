@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""Seekable replay of recorded rounds.
+
+A RoundReplay holds the deal and the move stream of a round (bids, the
+discard and the cards played) along with keyframes of the round state:
+after the deal, after the discard, every `interval` tricks and every
+`interval` times around the table in the bidding. seek restores the
+nearest keyframe and replays at most `interval` tricks of moves, so any
+position is rebuilt in bounded time.
+
+Replays are recorded from game events (ReplayRecorder), read from a JSON
+event log (load_log, see JsonLogWriter) or rebuilt from completed rounds
+(RoundReplay.from_round, see RoundHistory). Hands are kept in dealt order,
+the kitty is added when bidding completes as Game.bid_round does.
+
+    python fivehundred/replay.py game.log --round 3 --move 25
+"""
+import argparse
+import json
+from bisect import bisect_right
+from collections import namedtuple
+
+import game
+from events import BidMade, CardPlayed, Deal, Discard, RoundStarted
+from game import RULES, Bid, Card, Hand, Round, RoundHistory, Trick
+
+Position = namedtuple("Position", "index round players kitty trick")
+
+BID = 0
+DISCARD = 1
+CARD = 2
+
+_cards_by_code = {card.code(): card for card in Card.cards}
+
+
+class RoundReplay(object):
+    """Moves and keyframes of a round.
+
+    Args:
+        rules (Rules): rule set of the round
+        number (int): round number
+        dealer (int): player index of the dealer
+        hands (list): list of lists of Card objects dealt to each player,
+            followed by the kitty
+        interval (int): tricks between keyframes
+
+    Attributes:
+        moves (list): list of (kind, seat, value) tuples, value is a Bid for
+            BID, list of Card objects for DISCARD and a Card for CARD
+        keyframes (list): list of (move index, state) tuples, see snapshot
+    """
+
+    def __init__(self, rules, number, dealer, hands, interval=2):
+        self.rules = rules
+        self.number = number
+        self.dealer = dealer
+        self.hands = [list(hand) for hand in hands]
+        self.interval = interval
+        self.moves = []
+        self._live = self._deal()
+        self._bids = 0
+        self.keyframes = [(0, self.snapshot(self._live))]
+        self._indices = [0]
+
+    def __len__(self):
+        return len(self.moves)
+
+    @classmethod
+    def from_round(cls, round_, interval=2):
+        """Rebuilds the replay of a completed round, see RoundHistory.
+
+        Notes:
+            The order of the discarded cards is not recorded, they are
+            discarded in hand order.
+        """
+        rules = round_.rules
+        players = rules.players
+        replay = cls(rules, round_.number, round_.dealer, round_.starting_hands, interval)
+        for i, bid in enumerate(round_.bids):
+            replay.bid((round_.dealer + 1 + i) % players, bid)
+        if not round_.tricks:
+            return replay
+
+        bidder = round_.highest_bidder
+        played = set(card for trick in round_.tricks for card in trick.cards)
+        replay.discard(
+            bidder, [card for card in replay._live.players[bidder].cards if card not in played]
+        )
+        partner = None
+        if round_.highest_bid.misere is not None and rules.partner:
+            partner = (bidder + rules.partner) % players
+        for trick in round_.tricks:
+            seat = trick.lead
+            for card in trick.cards:
+                if seat == partner:
+                    seat = (seat + 1) % players
+                replay.card(seat, card)
+                seat = (seat + 1) % players
+        return replay
+
+    def bid(self, seat, bid):
+        """Appends a bid, including the passes of passed players."""
+        self._append((BID, seat, bid))
+
+    def discard(self, seat, cards):
+        """Appends the discard of the highest bidder."""
+        self._append((DISCARD, seat, list(cards)))
+
+    def card(self, seat, card):
+        """Appends a card played."""
+        self._append((CARD, seat, card))
+
+    def trick_index(self, number):
+        """Returns the move index of the first card of a trick."""
+        first = next((i for i, move in enumerate(self.moves) if move[0] == CARD), None)
+        if first is None or first + number * self._trick_size() >= len(self.moves):
+            raise IndexError("trick not played")
+        return first + number * self._trick_size()
+
+    def seek(self, index):
+        """Rebuilds the position after the first index moves.
+
+        Returns:
+            Position, the objects are new and may be modified freely
+        """
+        if index < 0:
+            index += len(self.moves) + 1
+        if not 0 <= index <= len(self.moves):
+            raise IndexError("move index out of range")
+        start, state = self.keyframes[bisect_right(self._indices, index) - 1]
+        position = self.restore(start, state)
+        for move in self.moves[start:index]:
+            position = self._apply(position, move)
+        return position
+
+    def snapshot(self, position):
+        """Returns a compact immutable state of a position.
+
+        Notes:
+            Cards and bids are stored as id bytes, tricks as in RoundHistory
+            records.
+        """
+        r = position.round
+        trick = position.trick
+        return (
+            tuple(bytes(card.id for card in player.cards) for player in position.players),
+            bytes(card.id for card in position.kitty.cards),
+            position.kitty.label,
+            r.turn,
+            RoundHistory.statuses.index(r.status),
+            tuple(r.passes),
+            bytes(bid.id for bid in r.bids),
+            r.highest_bid.id,
+            r.highest_bidder,
+            len(self.rules.possible) - len(r.possible_bids),
+            tuple((t.lead, t.winner, bytes(card.id for card in t.cards)) for t in r.tricks),
+            None if trick is None else (trick.lead, bytes(card.id for card in trick.cards)),
+            tuple(r.tricks_won),
+            tuple(r.scores),
+        )
+
+    def restore(self, index, state):
+        """Returns the Position of a snapshot taken after index moves."""
+        (
+            hands,
+            kitty_ids,
+            kitty_label,
+            turn,
+            status,
+            passes,
+            bid_ids,
+            highest_bid,
+            highest_bidder,
+            possible,
+            tricks,
+            trick_state,
+            tricks_won,
+            scores,
+        ) = state
+        rules = self.rules
+        cards = Card.cards
+
+        r = Round(self.number, self.dealer, rules)
+        r.starting_hands = [list(hand) for hand in self.hands]
+        r.turn = turn
+        r.status = RoundHistory.statuses[status]
+        r.passes = list(passes)
+        r.bids = [Bid.ladder[i] for i in bid_ids]
+        r.highest_bid = Bid.ladder[highest_bid]
+        r.highest_bidder = highest_bidder
+        if r.status != "Bidding in progress":
+            r.trump_suit = r.highest_bid.suit
+        r.possible_bids = rules.possible[possible:]
+        r.tricks_won = list(tricks_won)
+        r.scores = list(scores)
+
+        misere = highest_bidder if r.highest_bid.misere is not None else None
+        suits = Card.suits[r.trump_suit]
+        for number, (lead, winner, ids) in enumerate(tricks):
+            t = Trick(lead, number, misere, rules)
+            t.cards = [cards[i] for i in ids]
+            t.lead_suit = suits[ids[0]]
+            t.winner = winner
+            r.tricks.append(t)
+        trick = None
+        if trick_state is not None:
+            lead, ids = trick_state
+            trick = Trick(lead, len(tricks), misere, rules)
+            trick.cards = [cards[i] for i in ids]
+            trick.lead_suit = suits[ids[0]]
+
+        players = []
+        for seat, ids in enumerate(hands):
+            player = Hand("P%s" % (seat + 1))
+            player.cards = [cards[i] for i in ids]
+            players.append(player)
+        kitty = Hand(kitty_label)
+        kitty.cards = [cards[i] for i in kitty_ids]
+        return Position(index, r, players, kitty, trick)
+
+    def _deal(self):
+        r = Round(self.number, self.dealer, self.rules)
+        r.starting_hands = [list(hand) for hand in self.hands]
+        r.turn = (self.dealer + 1) % self.rules.players
+        players = []
+        for seat, cards in enumerate(self.hands[:-1]):
+            player = Hand("P%s" % (seat + 1))
+            player.cards = list(cards)
+            players.append(player)
+        kitty = Hand("Kitty")
+        kitty.cards = list(self.hands[-1])
+        return Position(0, r, players, kitty, None)
+
+    def _trick_size(self):
+        r = self._live.round
+        sitting_out = r.highest_bid.misere is not None and self.rules.partner is not None
+        return self.rules.players - sitting_out
+
+    def _append(self, move):
+        self.moves.append(move)
+        live = self._live = self._apply(self._live, move)
+        kind = move[0]
+        keyframe = kind == DISCARD
+        if kind == BID:
+            self._bids += 1
+            keyframe = self._bids % (self.interval * self.rules.players) == 0
+        elif kind == CARD and live.trick is None:
+            keyframe = len(live.round.tricks) % self.interval == 0
+        if keyframe:
+            self.keyframes.append((live.index, self.snapshot(live)))
+            self._indices.append(live.index)
+
+    def _apply(self, position, move):
+        """Applies a move as the Game rounds do, returns the new Position."""
+        index, r, players, kitty, trick = position
+        kind, seat, value = move
+
+        if kind == BID:
+            r.make_bid(value)
+            r.update_status()
+            if r.status == "Bidding complete":
+                r.trump_suit = r.highest_bid.suit
+                kitty.deal_cards(players[r.highest_bidder], 3)
+
+        elif kind == DISCARD:
+            players[seat].move_cards(kitty, value)
+            kitty.label = "Discard"
+
+        else:
+            if r.status != "Card play in progress":
+                r.status = "Card play in progress"
+                r.turn = r.highest_bidder
+            if trick is None:
+                misere = r.highest_bidder if r.highest_bid.misere is not None else None
+                trick = Trick(r.turn, len(r.tricks), misere, self.rules)
+                trick.lead_suit = Card.suits[r.trump_suit][value.id]
+            players[seat].move_cards(trick, [value])
+            r.increment_turn()
+
+            if trick.is_complete():
+                # Trick.get_winner reads the module trump suit
+                trump_suit = game.trump_suit
+                game.trump_suit = r.trump_suit
+                trick.set_winner()
+                game.trump_suit = trump_suit
+
+                r.turn = trick.winner
+                r.tricks_won[self.rules.team(trick.winner)] += 1
+                r.tricks.append(trick)
+                trick = None
+                if len(r.tricks) == self.rules.tricks:
+                    r.status = "Card play complete"
+                    r.set_scores()
+
+        return Position(index + 1, r, players, kitty, trick)
+
+
+class ReplayRecorder(object):
+    """Records a RoundReplay for each round from game events.
+
+    Args:
+        rules (Rules): rule set of the game
+        interval (int): tricks between keyframes
+
+    Attributes:
+        rounds (list): RoundReplay objects in round order
+    """
+
+    def __init__(self, rules, interval=2):
+        self.rules = rules
+        self.interval = interval
+        self.rounds = []
+        self._dealer = None
+
+    def __call__(self, event):
+        if type(event) is RoundStarted:
+            self._dealer = event.dealer
+        elif type(event) is Deal:
+            self.rounds.append(
+                RoundReplay(
+                    self.rules,
+                    event.round,
+                    self._dealer,
+                    list(event.hands) + [event.kitty],
+                    self.interval,
+                )
+            )
+        elif type(event) is BidMade:
+            self.rounds[-1].bid(event.seat, event.bid)
+        elif type(event) is Discard:
+            self.rounds[-1].discard(event.seat, event.cards)
+        elif type(event) is CardPlayed:
+            self.rounds[-1].card(event.seat, event.card)
+
+
+def load_log(f, rules=None, interval=2):
+    """Reads the rounds of a JSON event log, see JsonLogWriter.
+
+    Args:
+        f (file): open text file of JSON lines
+        rules (Rules): rule set of the game, standard rules if NoneType
+        interval (int): tricks between keyframes
+
+    Returns:
+        list of RoundReplay objects
+    """
+    recorder = ReplayRecorder(rules if rules is not None else RULES["standard"], interval)
+    cards = _cards_by_code
+    for line in f:
+        record = json.loads(line)
+        name = record["event"]
+        if name == "RoundStarted":
+            event = RoundStarted(record["round"], record["dealer"])
+        elif name == "Deal":
+            hands = [[cards[code] for code in hand] for hand in record["hands"]]
+            event = Deal(record["round"], hands, [cards[code] for code in record["kitty"]])
+        elif name == "BidMade":
+            bid = record["bid"]
+            event = BidMade(record["seat"], Bid(None if bid == "Ps" else bid))
+        elif name == "Discard":
+            event = Discard(record["seat"], [cards[code] for code in record["cards"]])
+        elif name == "CardPlayed":
+            event = CardPlayed(record["trick"], record["seat"], cards[record["card"]])
+        else:
+            continue
+        recorder(event)
+    return recorder.rounds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", type=str, help="JSON event log, see game.py --log")
+    parser.add_argument(
+        "--rules", type=str, choices=sorted(RULES), default="standard", help="Rule variant"
+    )
+    parser.add_argument("--round", type=int, default=1, help="Round number")
+    parser.add_argument("--move", type=int, default=None, help="Move index, end of round if omitted")
+    parser.add_argument("--trick", type=int, default=None, help="Jump to the start of a trick")
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        rounds = load_log(f, RULES[args.rules])
+    replay = rounds[args.round - 1]
+    if args.trick is not None:
+        index = replay.trick_index(args.trick - 1)
+    elif args.move is not None:
+        index = args.move
+    else:
+        index = len(replay)
+    position = replay.seek(index)
+
+    game.trump_suit = position.round.trump_suit
+    r = position.round
+    print("Move          : {0}/{1}".format(position.index, len(replay)))
+    print("Status        :", r.status)
+    print("Bid History   :", "|".join([str(bid) for bid in r.bids]))
+    if r.highest_bidder is not None:
+        print("Highest Bid   :", position.players[r.highest_bidder].label, "-", r.highest_bid)
+    for player in position.players:
+        player.sort()
+        print(player.label, player)
+    print(position.kitty.label, position.kitty)
+    if position.trick is not None:
+        print("Trick {0} - {1}".format(position.trick.number + 1, position.trick))
+    print("Trick Count   :", r.tricks_won)
+    print("Round Score   :", r.scores)
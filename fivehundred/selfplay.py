@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Parallel self-play data generation.
+
+Worker processes play games with the chosen policies and record every bid,
+discard and card decision as (observation, legal mask, action, final round
+score). Records are sent through a bounded queue to a writer thread which
+writes size capped compressed NumPy shards, one series per decision type:
+
+    bid-00000.npz, discard-00000.npz, card-00000.npz, ...
+
+Each shard holds the arrays obs, mask, action and score.
+
+Requires numpy.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+import game
+from ai import Policy
+from game import RULES, Bid, Card, Game
+
+KINDS = ("bid", "discard", "card")
+NUM_CARDS = len(Card.cards)  # card ids
+NUM_BIDS = len(Bid.ladder)  # bid ids including pass
+
+
+def cards_vector(cards):
+    """Returns a multi-hot vector over card ids."""
+    vector = np.zeros(NUM_CARDS, np.int8)
+    vector[[card.id for card in cards]] = 1
+    return vector
+
+
+def mask_vector(mask):
+    """Returns a multi-hot vector over card ids from a card id bitmask."""
+    return np.array([mask >> i & 1 for i in range(NUM_CARDS)], np.int8)
+
+
+def bid_vector(bid):
+    """Returns a one-hot vector over bid ids."""
+    vector = np.zeros(NUM_BIDS, np.int8)
+    vector[bid.id] = 1
+    return vector
+
+
+class RecordingPolicy(Policy):
+    """Policy that records each decision it makes.
+
+    Attributes:
+        players (list): Hand objects of the game being played
+        rules (Rules): rule set of the game being played
+        pending (dict): per kind list of (seat, obs, mask, action) records
+            of the current round
+        records (dict): per kind list of (obs, mask, action, score) records
+            of completed rounds
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingPolicy, self).__init__(*args, **kwargs)
+        self.players = []
+        self.rules = RULES["standard"]
+        self.pending = {kind: [] for kind in KINDS}
+        self.records = {kind: [] for kind in KINDS}
+
+    def bid(self, env, type_):
+        player, bids, possible, Bid = env
+        bid_text = super(RecordingPolicy, self).bid(env, type_)
+
+        highest = self.rules.highest_bid(bids)
+        obs = np.concatenate([cards_vector(player.cards), bid_vector(highest)])
+        mask = np.zeros(NUM_BIDS, np.int8)
+        mask[0] = 1
+        mask[[Bid(bid).id for bid in possible]] = 1
+        self.pending["bid"].append((self.players.index(player), obs, mask, Bid(bid_text).id))
+        return bid_text
+
+    def discard(self, env, type_):
+        cards, bid = env
+        discard_cards = super(RecordingPolicy, self).discard(env, type_)
+
+        obs = np.concatenate([cards_vector(cards), bid_vector(bid)])
+        action = [card.id for card in discard_cards]
+        self.pending["discard"].append((None, obs, cards_vector(cards), action))
+        return discard_cards
+
+    def card(self, env, type_):
+        player, trick, tricks, knowledge = env
+        card_index = super(RecordingPolicy, self).card(env, type_)
+
+        lead = np.zeros(5, np.int8)
+        lead[4 if trick.lead_suit is None else trick.lead_suit] = 1
+        obs = np.concatenate(
+            [
+                cards_vector(player.cards),
+                mask_vector(knowledge.played),
+                cards_vector(trick.cards),
+                lead,
+            ]
+        )
+        mask = cards_vector(player.possible)
+        action = player.cards[card_index].id
+        self.pending["card"].append((knowledge.seat, obs, mask, action))
+        return card_index
+
+    def end_round(self, round_):
+        """Attaches the final round score to the decisions of the round."""
+        for kind in KINDS:
+            for seat, obs, mask, action in self.pending[kind]:
+                if seat is None:  # discard, made by the highest bidder
+                    seat = round_.highest_bidder
+                self.records[kind].append((obs, mask, action, round_.scores[round_.rules.team(seat)]))
+            self.pending[kind] = []
+
+    def pop_batch(self):
+        """Returns the completed records as a dict of arrays per kind."""
+        batch = {}
+        for kind in KINDS:
+            records = self.records[kind]
+            if records:
+                obs, mask, action, score = zip(*records)
+                batch[kind] = {
+                    "obs": np.stack(obs),
+                    "mask": np.stack(mask),
+                    "action": np.array(action, np.int16),
+                    "score": np.array(score, np.int16),
+                }
+            self.records[kind] = []
+        return batch
+
+
+def play_game(policy, policies):
+    """Plays a game with the given policy, see game.py __main__."""
+    bid_policy, discard_policy, card_policy = policies
+    g = Game(policy=policy)
+    policy.players = g.players
+    policy.rules = g.rules
+    while g.status == "In progress":
+        game.trump_suit = None
+        g.start_round()
+        g.bid_round(policy=bid_policy)
+        if g.round.status == "Bidding complete":
+            game.trump_suit = g.round.trump_suit
+            g.discard_round(policy=discard_policy)
+            g.card_round(policy=card_policy)
+        g.end_round()
+        policy.end_round(g.round)
+    game.trump_suit = None
+
+
+def worker(games, policies, records, seed):
+    """Worker process playing games and sending record batches."""
+    np.random.seed(seed)
+    random.seed(seed)
+    policy = RecordingPolicy()
+    for _ in range(games):
+        play_game(policy, policies)
+        records.put(policy.pop_batch())  # blocks while the writer is behind
+    records.put(None)
+
+
+class ShardWriter(threading.Thread):
+    """Writer thread writing record batches to size capped shards.
+
+    Args:
+        records (Queue): queue of record batches, NoneType per finished worker
+        workers (int): number of workers feeding the queue
+        out (str): output directory
+        shard_bytes (int): maximum uncompressed size of a shard
+
+    Attributes:
+        written (dict): number of records written per kind
+        games (int): number of games received
+        shards (int): number of shards written
+    """
+
+    def __init__(self, records, workers, out, shard_bytes):
+        super(ShardWriter, self).__init__(daemon=True)
+        self.records = records
+        self.workers = workers
+        self.out = out
+        self.shard_bytes = shard_bytes
+        self.buffers = {kind: [] for kind in KINDS}
+        self.sizes = {kind: 0 for kind in KINDS}
+        self.counts = {kind: 0 for kind in KINDS}
+        self.written = {kind: 0 for kind in KINDS}
+        self.games = 0
+        self.shards = 0
+
+    def run(self):
+        finished = 0
+        while finished < self.workers:
+            batch = self.records.get()
+            if batch is None:
+                finished += 1
+                continue
+            self.games += 1
+            for kind, arrays in batch.items():
+                size = sum(a.nbytes for a in arrays.values())
+                if self.sizes[kind] and self.sizes[kind] + size > self.shard_bytes:
+                    self.flush(kind)
+                self.buffers[kind].append(arrays)
+                self.sizes[kind] += size
+        for kind in KINDS:
+            self.flush(kind)
+
+    def flush(self, kind):
+        """Writes the buffered records of a kind as a shard."""
+        buffers = self.buffers[kind]
+        if not buffers:
+            return
+        arrays = {key: np.concatenate([b[key] for b in buffers]) for key in buffers[0]}
+        filename = os.path.join(self.out, "%s-%05d.npz" % (kind, self.counts[kind]))
+        np.savez_compressed(filename, **arrays)
+        self.counts[kind] += 1
+        self.written[kind] += len(arrays["action"])
+        self.shards += 1
+        self.buffers[kind] = []
+        self.sizes[kind] = 0
+
+
+def generate(games, workers, out, policies, shard_bytes, queue_size, interval=5.0):
+    """Runs the self-play pipeline, reporting progress while it runs.
+
+    Args:
+        games (int): total number of games
+        workers (int): number of worker processes
+        out (str): output directory
+        policies (tuple): (bid, discard, card) policy types
+        shard_bytes (int): maximum uncompressed size of a shard
+        queue_size (int): maximum number of batches waiting for the writer
+        interval (float): seconds between progress reports
+    """
+    os.makedirs(out, exist_ok=True)
+    records = multiprocessing.Queue(queue_size)
+    writer = ShardWriter(records, workers, out, shard_bytes)
+    writer.start()
+
+    processes = []
+    for i in range(workers):
+        n = games // workers + (i < games % workers)
+        process = multiprocessing.Process(
+            target=worker, args=(n, policies, records, int(time.time()) + i)
+        )
+        process.start()
+        processes.append(process)
+
+    start = time.perf_counter()
+    failed = []
+    while writer.is_alive():
+        writer.join(interval)
+        for process in processes:
+            if process.exitcode not in (None, 0) and process not in failed:
+                failed.append(process)
+                records.put(None)  # the end of batches the worker never sent
+        elapsed = time.perf_counter() - start
+        try:
+            depth = records.qsize()
+        except NotImplementedError:  # macOS
+            depth = "?"
+        print(
+            "Games {0}/{1} | {2:.1f} games/s | queue {3}/{4} | shards {5}".format(
+                writer.games, games, writer.games / elapsed, depth, queue_size, writer.shards
+            )
+        )
+
+    for process in processes:
+        process.join()
+    print("Records written:", writer.written)
+    if failed:
+        raise RuntimeError("%s of %s self-play workers failed" % (len(failed), workers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=1000, help="Number of games")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser.add_argument("--out", type=str, default="selfplay", help="Output directory")
+    parser.add_argument("--bidai", type=str, default="score", help="Bid Round AI")
+    parser.add_argument("--discardai", type=str, default="lowest", help="Discard Round AI")
+    parser.add_argument("--cardai", type=str, default="counting", help="Card Round AI")
+    parser.add_argument("--shardmb", type=float, default=64, help="Shard size cap in MB")
+    parser.add_argument("--queue", type=int, default=64, help="Record queue size")
+    parser.add_argument(
+        "--interval", type=float, default=5.0, help="Seconds between progress reports"
+    )
+    args = parser.parse_args()
+
+    generate(
+        args.games,
+        args.workers,
+        args.out,
+        (args.bidai, args.discardai, args.cardai),
+        int(args.shardmb * 2 ** 20),
+        args.queue,
+        args.interval,
+    )
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""Asyncio game server hosting many concurrent tables.
+
+Protocol:
+    Newline delimited JSON over TCP. A client joins a table with
+    {"type": "join", "table": "t1", "humans": 2, "name": "me"}. The first
+    joiner sets how many human seats the table has (0 for a bots-only table
+    that the client watches). Play starts once all human seats are taken,
+    the remaining seats are filled by bots.
+
+    Human seats are sent {"type": "prompt", "action": ...} messages and
+    answer with {"type": "bid", "bid": "7S"}, {"type": "discard",
+    "cards": [0, 4, 12]} or {"type": "card", "index": 3}. All clients at a
+    table receive the public moves as they happen.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import game
+from events import BidMade, CardPlayed, Deal, Discard, RoundScored, TrickWon, encode
+from game import RULES, Bid, Game, Trick
+
+
+class Seat(object):
+    """Represents a seat at a table.
+
+    Attributes:
+        index (int): player index of the seat - [0-3]
+        name (str): display name
+        writer (StreamWriter): connection of a human, NoneType for a bot
+        moves (Queue): moves received from the human
+    """
+
+    def __init__(self, index, name="Bot", writer=None):
+        self.index = index
+        self.name = name
+        self.writer = writer
+        self.moves = asyncio.Queue()
+
+    def is_bot(self):
+        """Returns whether the seat is played by a bot."""
+        return self.writer is None
+
+
+class Table(object):
+    """Represents a table of 4 seats playing a game.
+
+    Notes:
+        All engine calls are run through the server engine executor, which
+        sets the module level trump suit for the table before each call.
+        This keeps the event loop free while tables share one engine.
+
+    Args:
+        server (Server): owning server
+        name (str): table name
+        humans (int): number of human seats, the first seats of the table
+            - [0-4]
+
+    Attributes:
+        game (Game): game being played
+        seats (list): list of Seat objects
+        watchers (list): StreamWriter objects receiving public messages
+        ready (Event): set once all human seats are taken
+        moves (int): number of moves made at the table
+    """
+
+    def __init__(self, server, name, humans=1):
+        self.server = server
+        self.name = name
+        self.humans = humans
+        self.game = Game()
+        self.seats = [Seat(i) for i in range(4)]
+        self.watchers = []
+        self.ready = asyncio.Event()
+        self.moves = 0
+        self.game.events.subscribe(
+            self.on_event, Deal, BidMade, Discard, CardPlayed, TrickWon, RoundScored
+        )
+        if humans == 0:
+            self.ready.set()
+
+    def join(self, writer, name):
+        """Takes the first free human seat, returns its index or NoneType.
+
+        Notes:
+            A seat left by a disconnected client is free again, moves the
+            client sent before leaving are dropped.
+        """
+        self.watchers.append(writer)
+        free = [seat for seat in self.seats[: self.humans] if seat.is_bot()]
+        if not free:
+            return None
+
+        seat = free[0]
+        seat.writer = writer
+        seat.name = name
+        seat.moves = asyncio.Queue()
+        self.game.players[seat.index].label = name
+        if len(free) == 1:
+            self.ready.set()
+        return seat.index
+
+    def leave(self, writer):
+        """Hands any seat of a disconnected client over to a bot."""
+        if writer in self.watchers:
+            self.watchers.remove(writer)
+        for seat in self.seats:
+            if seat.writer is writer:
+                seat.writer = None
+                seat.moves.put_nowait(None)
+
+    def send(self, writer, message):
+        """Sends a message to a single client."""
+        if writer is not None and not writer.is_closing():
+            writer.write((json.dumps(message) + "\n").encode())
+
+    def broadcast(self, message):
+        """Sends a message to every client at the table."""
+        message["table"] = self.name
+        for writer in self.watchers:
+            self.send(writer, message)
+
+    def on_event(self, event):
+        """Sends game events to the clients at the table."""
+        if threading.get_ident() != self.thread:  # emitted in the engine executor
+            self.loop.call_soon_threadsafe(self.on_event, event)
+            return
+
+        if type(event) is Deal:
+            for seat in self.seats:
+                self.send(
+                    seat.writer,
+                    {"type": "deal", "round": event.round, "hand": encode(event.hands[seat.index])},
+                )
+        elif type(event) is BidMade:
+            self.broadcast({"type": "bid", "seat": event.seat, "bid": str(event.bid)})
+        elif type(event) is Discard:
+            self.broadcast({"type": "discard", "seat": event.seat})
+        elif type(event) is CardPlayed:
+            self.broadcast({"type": "card", "seat": event.seat, "card": event.card.code()})
+        elif type(event) is TrickWon:
+            self.broadcast({"type": "trick", "winner": event.trick.winner})
+        elif type(event) is RoundScored:
+            self.broadcast(
+                {"type": "round", "scores": event.scores, "game_scores": event.game_scores}
+            )
+
+    def _call(self, trump_suit, fn, args):
+        game.trump_suit = trump_suit
+        return fn(*args)
+
+    async def engine(self, fn, *args):
+        """Runs an engine call in the engine executor."""
+        trump_suit = self.game.round.trump_suit if self.game.round else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.server.executor, self._call, trump_suit, fn, args
+        )
+
+    async def bot_move(self, fn, env, type_):
+        """Runs a bot policy decision and records its latency."""
+        start = time.perf_counter()
+        result = await self.engine(fn, env, type_)
+        self.server.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def human_move(self, seat, prompt):
+        """Prompts a human seat and waits for its move.
+
+        Returns:
+            move message, or NoneType if the human left the table
+        """
+        self.send(seat.writer, prompt)
+        return await seat.moves.get()
+
+    async def play(self):
+        """Plays the game to completion."""
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.get_ident()
+        await self.ready.wait()
+        self.broadcast(
+            {"type": "start", "seats": [seat.name for seat in self.seats]}
+        )
+        while self.game.status == "In progress":
+            await self.play_round()
+        self.broadcast({"type": "game", "scores": self.game.scores})
+
+    async def play_round(self):
+        """Plays a round of bidding, discarding and card play."""
+        g = self.game
+        g.round = None
+        await self.engine(g.start_round)
+
+        await self.bid_round()
+        if g.round.status == "Bidding complete":
+            await self.discard_round()
+            await self.card_round()
+
+        g.end_round()
+
+    async def bid_round(self):
+        """Bidding, see Game.bid_round."""
+        g = self.game
+        br = g.round
+        await self.engine(g.start_bidding)
+
+        while br.status == "Bidding in progress":
+            if br.passes[br.turn]:
+                await self.engine(g.make_bid, Bid(None))
+                continue
+
+            seat = self.seats[br.turn]
+            bid = None
+            if not seat.is_bot():
+                move = await self.human_move(
+                    seat,
+                    {"type": "prompt", "action": "bid", "possible": br.possible_bids},
+                )
+                if move is not None:
+                    bid_text = move.get("bid") or ""
+                    bid = Bid(bid_text) if isinstance(bid_text, str) else None
+                    if (
+                        bid is None
+                        or not bid.valid
+                        or not (bid.pass_ or bid.bid in br.possible_bids)
+                    ):
+                        self.send(seat.writer, {"type": "error", "message": "Not a valid bid"})
+                        continue
+
+            if bid is None:
+                try:
+                    bid_text = await self.bot_move(
+                        self.game.policy.bid,
+                        (g.players[br.turn], br.bids, br.possible_bids, Bid),
+                        self.server.policies[0],
+                    )
+                except IndexError:
+                    bid_text = ""
+                bid = Bid(bid_text)
+
+            await self.engine(g.make_bid, bid)
+            self.moves += 1
+
+        await self.engine(g.end_bidding)
+
+    async def discard_round(self):
+        """Kitty discard, see Game.discard_round."""
+        g = self.game
+        dr = g.round
+        player = g.players[dr.highest_bidder]
+        seat = self.seats[dr.highest_bidder]
+
+        cards = None
+        while cards is None and not seat.is_bot():
+            move = await self.human_move(
+                seat, {"type": "prompt", "action": "discard", "hand": encode(player)}
+            )
+            if move is None:
+                break
+            indices = move.get("cards")
+            if (
+                isinstance(indices, list)
+                and all(type(i) is int and 0 <= i < len(player.cards) for i in indices)
+                and len(set(indices)) == 3
+            ):
+                cards = [player.cards[i] for i in set(indices)]
+            else:
+                self.send(seat.writer, {"type": "error", "message": "Discard 3 cards"})
+
+        if cards is None:
+            cards = await self.bot_move(
+                self.game.policy.discard, (player.cards, dr.highest_bid), self.server.policies[1]
+            )
+
+        await self.engine(g.make_discard, cards)
+        self.moves += 1
+
+    async def card_round(self):
+        """Card play, see Game.card_round."""
+        g = self.game
+        cr = g.round
+        misere = await self.engine(g.start_card_play)
+
+        for trick_num in range(g.rules.tricks):
+            trick = Trick(cr.turn, trick_num, misere, g.rules)
+
+            while not trick.is_complete():
+                player = g.players[cr.turn]
+                seat = self.seats[cr.turn]
+                await self.engine(player.set_possible, trick)
+
+                hand_index = None
+                while hand_index is None and not seat.is_bot():
+                    move = await self.human_move(
+                        seat,
+                        {
+                            "type": "prompt",
+                            "action": "card",
+                            "hand": encode(player),
+                            "possible": list(player.possible_index),
+                        },
+                    )
+                    if move is None:
+                        break
+                    index = move.get("index")
+                    if type(index) is not int or not 0 <= index < len(player.cards):
+                        self.send(seat.writer, {"type": "error", "message": "Not a valid card"})
+                    elif index in player.possible_index:
+                        hand_index = index
+                    else:
+                        self.send(seat.writer, {"type": "error", "message": "Need to follow suit"})
+
+                if hand_index is None:
+                    hand_index = await self.bot_move(
+                        self.game.policy.card,
+                        (player, trick, cr.tricks, cr.knowledge[cr.turn]),
+                        self.server.policies[2],
+                    )
+
+                await self.engine(g.play_card, hand_index, trick)
+                self.moves += 1
+
+            await self.engine(g.end_trick, trick)
+
+        await self.engine(g.end_card_play)
+
+
+class Server(object):
+    """Hosts many tables over TCP.
+
+    Args:
+        policies (tuple): bot (bid, discard, card) policy types
+
+    Attributes:
+        tables (dict): Table objects by name
+        executor (ThreadPoolExecutor): single worker engine executor
+        latencies (list): bot move latencies in seconds
+    """
+
+    def __init__(self, policies=("score", "lowest", "basic")):
+        self.policies = policies
+        self.tables = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = []
+
+    def get_table(self, name, humans=1):
+        """Returns the named table, creating and starting it if needed."""
+        if name not in self.tables:
+            table = Table(self, name, humans)
+            self.tables[name] = table
+            task = asyncio.ensure_future(table.play())
+            task.add_done_callback(lambda t: self.tables.pop(name, None))
+        return self.tables[name]
+
+    async def handle(self, reader, writer):
+        """Handles a client connection."""
+        table = None
+        seat = None
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+
+                if message.get("type") == "join" and table is None:
+                    humans = message.get("humans", 1)
+                    if type(humans) is not int or not 0 <= humans <= RULES["standard"].players:
+                        error = {"type": "error", "message": "Not a valid join"}
+                        writer.write((json.dumps(error) + "\n").encode())
+                        continue
+                    table = self.get_table(str(message.get("table", "")), humans)
+                    seat = table.join(writer, message.get("name", "Human"))
+                    table.send(writer, {"type": "joined", "table": table.name, "seat": seat})
+                elif seat is not None:
+                    table.seats[seat].moves.put_nowait(message)
+        except ConnectionError:
+            pass
+        finally:
+            if table is not None:
+                table.leave(writer)
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=5000):
+        """Starts the TCP server."""
+        return await asyncio.start_server(self.handle, host, port)
+
+    def stats(self):
+        """Returns bot move latency statistics in milliseconds."""
+        if not self.latencies:
+            return {}
+        latencies = sorted(self.latencies)
+        return {
+            "moves": len(latencies),
+            "mean": 1000 * sum(latencies) / len(latencies),
+            "p99": 1000 * latencies[int(len(latencies) * 0.99)],
+            "max": 1000 * latencies[-1],
+        }
+
+
+async def scripted_client(host, port, table, humans=1, name="Script"):
+    """Local client that plays legal random moves, for testing.
+
+    Returns:
+        final game scores
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        (json.dumps({"type": "join", "table": table, "humans": humans, "name": name}) + "\n").encode()
+    )
+
+    scores = None
+    async for line in reader:
+        message = json.loads(line)
+        if message["type"] == "prompt":
+            if message["action"] == "bid":
+                move = {"type": "bid", "bid": random.choice([""] + message["possible"][:3])}
+            elif message["action"] == "discard":
+                move = {"type": "discard", "cards": random.sample(range(len(message["hand"])), 3)}
+            else:
+                move = {"type": "card", "index": random.choice(message["possible"])}
+            writer.write((json.dumps(move) + "\n").encode())
+        elif message["type"] == "game":
+            scores = message["scores"]
+            break
+
+    writer.close()
+    return scores
+
+
+async def load_test(tables, humans, port):
+    """Runs scripted clients against a local server."""
+    server = Server()
+    tcp = await server.serve(port=port)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            scripted_client("127.0.0.1", port, "table%s" % i, humans, "S%s" % j)
+            for i in range(tables)
+            for j in range(max(humans, 1))
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    tcp.close()
+    await tcp.wait_closed()
+
+    print("Tables        :", tables)
+    print("Elapsed (s)   : %.2f" % elapsed)
+    print("Bot moves     :", server.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host")
+    parser.add_argument("--port", type=int, default=5000, help="Port")
+    parser.add_argument("--bidai", type=str, default="score", help="Bot Bid Round AI")
+    parser.add_argument("--discardai", type=str, default="lowest", help="Bot Discard Round AI")
+    parser.add_argument("--cardai", type=str, default="basic", help="Bot Card Round AI")
+    parser.add_argument(
+        "--loadtest",
+        type=int,
+        default=None,
+        help="Run the given number of tables with local scripted clients",
+    )
+    parser.add_argument(
+        "--humans", type=int, default=1, help="Scripted humans per table for --loadtest"
+    )
+    args = parser.parse_args()
+
+    if args.loadtest:
+        asyncio.run(load_test(args.loadtest, args.humans, args.port))
+    else:
+        server = Server((args.bidai, args.discardai, args.cardai))
+
+        async def main():
+            tcp = await server.serve(args.host, args.port)
+            async with tcp:
+                await tcp.serve_forever()
+
+        asyncio.run(main())